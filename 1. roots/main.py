@@ -1,9 +1,15 @@
-from typing import Callable, List
-import matplotlib.pyplot as plt
+from typing import Callable, List, Sequence
 import numpy as np
+import functools
+import threading
 import math
+import sys
+import os
 # import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import function, instrument, profiling, run_batch
+
 
 class interval:
     def __init__(self, start: float, end: float) -> None:
@@ -29,102 +35,441 @@ class interval:
 
 
 class root:
-    def __init__(self, val, abs_dif, it, method, sect_len=0):
+    stop_reasons = {
+        "converged": "достигнута заданная точность",
+        "max_iter": "превышено максимальное число итераций",
+        "max_evals": "превышено максимальное число вычислений функции",
+        "no_bracket": "функция не меняет знак на концах отрезка",
+        "zero_derivative": "производная (наклон секущей) обратилась в ноль",
+        "diverged": "итерации разошлись",
+    }
+
+    def __init__(self, val, abs_dif, it, method, sect_len=0, f_evals=0, df_evals=0, cache_hits=0,
+                 stop_reason="converged"):
         self.abs_dif = abs_dif
         self.iterations = it
+        self.f_evals = f_evals
+        self.df_evals = df_evals
+        self.cache_hits = cache_hits
         self.val = val
         self.method = method
         self.sect_len = sect_len
+        self.stop_reason = stop_reason
+
+    def converged(self) -> bool:
+        return self.stop_reason == "converged"
 
     def __str__(self):
         res = f"{self.method}:\n\n" \
                 f"Приближённое решение x = {self.val}\n\n" \
                 f"Число итераций метода: {self.iterations}\n\n" \
+                f"Число вычислений f(x): {self.f_evals}, f'(x): {self.df_evals}, из кэша: {self.cache_hits}\n\n" \
                 f"Модуль невязки: {self.abs_dif}\n\n"
         res += f"Длина последнего промежутка: {self.sect_len}\n" if self.sect_len > 0 else ""
+        res += f"Причина остановки: {self.stop_reasons[self.stop_reason]}\n" if not self.converged() else ""
         return res
 
 
+# wraps a scalar function with a bounded LRU cache, arrays are evaluated directly
+class cached_function:
+    def __init__(self, f: Callable[[float], float], cache_size: int = 4096) -> None:
+        self.func: Callable[[float], float] = f
+        self.cached = functools.lru_cache(maxsize=cache_size)(f)
+        self.array_evals: int = 0
+        # None - not probed yet, True - f accepts arrays, False - scalar-only f;
+        # objects with their own array path (common.function) need no probing
+        self.vectorized = True if hasattr(f, "many") else None
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            res = self.func(x)
+            self.array_evals += x.size
+            return res
+        return self.cached(x)
+
+    # evaluates f at every point of xs, falling back to scalar calls if f rejects arrays
+    def many(self, xs: np.ndarray) -> np.ndarray:
+        # one-element arrays can pass for scalars, so only probe on larger inputs
+        if self.vectorized or (self.vectorized is None and xs.size > 1):
+            try:
+                ys = np.asarray(self(xs), dtype=float)
+                if ys.shape == xs.shape:
+                    self.vectorized = True
+                    return ys
+            except (TypeError, ValueError):
+                pass
+            self.vectorized = False
+        return np.fromiter(map(self, xs), dtype=float, count=len(xs))
+
+    def evals(self) -> int:
+        return self.cached.cache_info().misses + self.array_evals
+
+    def hits(self) -> int:
+        return self.cached.cache_info().hits
+
+    def clear(self) -> None:
+        self.cached.cache_clear()
+        self.array_evals = 0
+
+
+# instrumentation of the root_finder entry points: the evaluation counters of the caches and the result
+def _finder_counters(finder) -> dict:
+    return dict(zip(("f_evals", "df_evals", "cache_hits"), finder.counters()))
+
+
+def _root_result(res) -> dict:
+    return dict(iterations=res.iterations, abs_dif=res.abs_dif, stop_reason=res.stop_reason)
+
+
+def _sections_result(res) -> dict:
+    return dict(sections=len(res))
+
+
+_instrument_solver = instrument(functions=("f", "df"), counters=_finder_counters, result=_root_result)
+_instrument_sections = instrument(functions=("f", "df"), counters=_finder_counters, result=_sections_result)
+
 
 class root_finder:
-    def __init__(self, f: Callable[[float], float], df, section: interval, steps_count: float, eps: float) -> None:
-        self.f: Callable[[float], float] = f
-        self.df: Callable[[float], float] = df
+    methods = ("bisection", "newton", "newton_enhanced", "secant", "brent")
+
+    def __init__(self, f: Callable[[float], float], df, section: interval, steps_count: float, eps: float,
+                 chunk_size: int = 1 << 16, cache_size: int = 4096, max_iter: int = 500, max_evals: int = 1000) -> None:
+        # a function object may carry its own derivative
+        df = getattr(f, "df", None) if df is None else df
+        self.cache_size: int = cache_size
+        self.f: cached_function = cached_function(f, cache_size)
+        self.df: cached_function = cached_function(df, cache_size) if df is not None else None
         self.section: interval = section
+        self.steps_count: int = int(steps_count)
         self.step: float = section.len() / steps_count
         self.eps: float = eps
-        
+        self.max_iter: int = max_iter
+        self.max_evals: int = max_evals
+        self.chunk_size: int = chunk_size
+        # f and df values at the points visited by get_root_sections_adaptive
+        self.samples: dict = {}
+        self.df_samples: dict = {}
+
+    def eval_many(self, xs: np.ndarray) -> np.ndarray:
+        return self.f.many(xs)
+
+    # index-based grid x_i = start + i * step, i in [lo, hi), with the last node pinned to the end
+    def grid(self, lo: int, hi: int) -> np.ndarray:
+        xs = self.section.start + np.arange(lo, hi) * self.step
+        if hi > self.steps_count:
+            xs[-1] = self.section.end
+        return xs
+
+    # copy with the same parameters and empty caches and counters
+    def clone(self):
+        return root_finder(self.f.func, self.df.func if self.df is not None else None, self.section,
+                           self.steps_count, self.eps, self.chunk_size, self.cache_size, self.max_iter, self.max_evals)
+
+    def counters(self):
+        df_evals = self.df.evals() if self.df is not None else 0
+        df_hits = self.df.hits() if self.df is not None else 0
+        return self.f.evals(), df_evals, self.f.hits() + df_hits
+
+    # evaluation counters accumulated since the snapshot taken by counters()
+    def eval_stats(self, since) -> dict:
+        f_evals, df_evals, cache_hits = (now - before for now, before in zip(self.counters(), since))
+        return dict(f_evals=f_evals, df_evals=df_evals, cache_hits=cache_hits)
+
+    @_instrument_sections
     def get_root_sections(self) -> List[interval]:
         res: List[interval] = []
-        start = self.section.start
-        end = self.section.end
-        cur_sect = interval(start, start + self.step)
+        num_nodes = self.steps_count + 1
+        prev_x, prev_y = None, None
+
+        # f is evaluated once per node, chunk by chunk, carrying the last node over to the next chunk
+        for lo in range(0, num_nodes, self.chunk_size):
+            xs = self.grid(lo, min(lo + self.chunk_size, num_nodes))
+            ys = self.eval_many(xs)
+            if prev_x is not None:
+                xs = np.concatenate(([prev_x], xs))
+                ys = np.concatenate(([prev_y], ys))
 
-        while cur_sect.end <= end:
-            val = self.calc_prod(cur_sect)
-            if val < 0:
-                res.append(interval(cur_sect.start, cur_sect.end))
-            cur_sect.advance(self.step)
+            for i in np.flatnonzero(ys[:-1] * ys[1:] < 0):
+                res.append(interval(float(xs[i]), float(xs[i + 1])))
+            prev_x, prev_y = xs[-1], ys[-1]
 
         return res
             
+    # values of func at xs, evaluating only the points missing from store
+    def sample(self, xs: np.ndarray, store: dict, func: cached_function) -> np.ndarray:
+        missing = [x for x in xs.tolist() if x not in store]
+        if missing:
+            store.update(zip(missing, func.many(np.array(missing)).tolist()))
+        return np.array([store[x] for x in xs.tolist()])
+
+    # adaptive bracketing: starts from the steps_count grid and splits (as interval.split does) only the
+    # intervals with a sign change or where |f| is small enough for a pair of roots to hide inside,
+    # until they are shorter than min_len. Whether f can reach zero is judged by the slope bound
+    # max|f'| taken from df at the endpoints, or from the steepest secant of the grid without df.
+    # Evaluated points are kept, so calling again with a smaller min_len only evaluates new points.
+    @_instrument_sections
+    def get_root_sections_adaptive(self, min_len: float, safety: float = 2.0) -> List[interval]:
+        res: List[interval] = []
+        xs = self.grid(0, self.steps_count + 1)
+        ys = self.sample(xs, self.samples, self.f)
+        a, b, fa, fb = xs[:-1], xs[1:], ys[:-1], ys[1:]
+        if self.df is not None:
+            dys = np.abs(self.sample(xs, self.df_samples, self.df))
+            dfa, dfb = dys[:-1], dys[1:]
+        else:
+            slope = np.max(np.abs(np.diff(ys))) / self.step if len(ys) > 1 else 0
+
+        while a.size > 0:
+            h = b - a
+            sign_change = fa * fb < 0
+            bound = safety * (np.maximum(dfa, dfb) if self.df is not None else slope) * h
+            done = h <= min_len
+
+            for i in np.flatnonzero(sign_change & done):
+                res.append(interval(float(a[i]), float(b[i])))
+
+            keep = ~done & (sign_change | (np.abs(fa) + np.abs(fb) <= bound))
+            a, b, fa, fb = a[keep], b[keep], fa[keep], fb[keep]
+            mid = (a + b) / 2
+            f_mid = self.sample(mid, self.samples, self.f)
+            a, b = np.concatenate((a, mid)), np.concatenate((mid, b))
+            fa, fb = np.concatenate((fa, f_mid)), np.concatenate((f_mid, fb))
+            if self.df is not None:
+                df_mid = np.abs(self.sample(mid, self.df_samples, self.df))
+                dfa, dfb = dfa[keep], dfb[keep]
+                dfa, dfb = np.concatenate((dfa, df_mid)), np.concatenate((df_mid, dfb))
+
+        res.sort(key=lambda section: section.start)
+        return res
+
     def calc_prod(self, section: interval) -> float:
         return self.f(section.start) * self.f(section.end)
     
+    @_instrument_solver
     def bisection(self, section: interval) -> List[root]:
+        since = self.counters()
         i: int = 0
         cur_section = section
         while cur_section.len() >= 2 * self.eps:
             left, right = cur_section.split()
             cur_section = left if self.calc_prod(left) < 0 else right
             i += 1
+            if profiling.tracing:
+                profiling.trace(start=cur_section.start, end=cur_section.end)
 
         root_val = cur_section.mid()
         abs_dif = abs(self.f(root_val))
 
-        return root(root_val, abs_dif, i, "Метод бисекции", cur_section.len())
+        return root(root_val, abs_dif, i, "Метод бисекции", cur_section.len(), **self.eval_stats(since))
+
+    # values of f at xs, xs[j] being a point of the section idx[j]; the evaluations and the cache hits
+    # counted by the cache are added to f_evals[idx[j]] and cache_hits[idx[j]]. The result is a new
+    # array, so callers may modify it
+    def eval_sections(self, xs: np.ndarray, idx: np.ndarray, f_evals: np.ndarray, cache_hits: np.ndarray) -> np.ndarray:
+        if self.f.vectorized is not False and xs.size > 1:
+            before = self.f.evals()
+            try:
+                ys = np.array(self.f(xs), dtype=float)
+                self.f.vectorized = ys.shape == xs.shape
+            except (TypeError, ValueError):
+                self.f.vectorized = False
+            if self.f.vectorized:
+                # the array path of the cache counts one evaluation per point
+                f_evals[idx] += (self.f.evals() - before) // xs.size
+                return ys
+
+        ys = np.empty(xs.size)
+        for j, x in enumerate(xs.tolist()):
+            evals, hits = self.f.evals(), self.f.hits()
+            ys[j] = self.f(x)
+            f_evals[idx[j]] += self.f.evals() - evals
+            cache_hits[idx[j]] += self.f.hits() - hits
+        return ys
+
+    # bisects all sections at once, keeping their endpoints in arrays
+    def bisection_many(self, sections: List[interval]) -> List[root]:
+        a = np.array([section.start for section in sections], dtype=float)
+        b = np.array([section.end for section in sections], dtype=float)
+        f_evals = np.zeros(len(sections), dtype=int)
+        cache_hits = np.zeros(len(sections), dtype=int)
+        every = np.arange(len(sections))
+        fa = self.eval_sections(a, every, f_evals, cache_hits)
+        its = np.zeros(len(sections), dtype=int)
+
+        active = np.flatnonzero(b - a >= 2 * self.eps)
+        while active.size > 0:
+            mid = (a[active] + b[active]) / 2
+            f_mid = self.eval_sections(mid, active, f_evals, cache_hits)
+            go_left = fa[active] * f_mid < 0
+
+            left, right = active[go_left], active[~go_left]
+            b[left] = mid[go_left]
+            a[right] = mid[~go_left]
+            fa[right] = f_mid[~go_left]
+            its[active] += 1
+
+            active = active[b[active] - a[active] >= 2 * self.eps]
+
+        root_vals = (a + b) / 2
+        abs_difs = np.abs(self.eval_sections(root_vals, every, f_evals, cache_hits))
+
+        return [root(float(root_vals[i]), float(abs_difs[i]), int(its[i]), "Метод бисекции", float(b[i] - a[i]),
+                     f_evals=int(f_evals[i]), cache_hits=int(cache_hits[i])) for i in range(len(sections))]
     
 
+    @_instrument_solver
     def newton(self, section: interval) -> List[root]:
+        since = self.counters()
         x_cur = section.mid()
-        i: int = 1
-        while True:
-            x_next = x_cur - self.f(x_cur) / self.df(x_cur)
+        for i in range(1, self.max_iter + 1):
+            df_cur = self.df(x_cur)
+            if df_cur == 0:
+                return root(x_cur, abs(self.f(x_cur)), i, "Метод Ньютона", **self.eval_stats(since),
+                            stop_reason="zero_derivative")
+            x_next = x_cur - self.f(x_cur) / df_cur
+            if profiling.tracing:
+                profiling.trace(x=x_next)
             if abs(x_cur - x_next) <= self.eps:
                 abs_dif = abs(self.f(x_next))
-                return root(x_next, abs_dif, i, "Метод Ньютона")
-            i += 1
+                return root(x_next, abs_dif, i, "Метод Ньютона", **self.eval_stats(since))
             x_cur = x_next
+
+        return root(x_cur, abs(self.f(x_cur)), self.max_iter, "Метод Ньютона", **self.eval_stats(since),
+                    stop_reason="max_iter")
     
+    @_instrument_solver
     def newton_enhanced(self, section: interval):
+        since = self.counters()
         x_cur = section.mid()
         const = self.df(x_cur)
-        i: int = 1
-        while True:
+        if const == 0:
+            return root(x_cur, abs(self.f(x_cur)), 0, "Модифицированный метод Ньютона", **self.eval_stats(since),
+                        stop_reason="zero_derivative")
+        for i in range(1, self.max_iter + 1):
             x_next = x_cur - self.f(x_cur) / const
+            if profiling.tracing:
+                profiling.trace(x=x_next)
             if abs(x_cur - x_next) <= self.eps:
                 abs_dif = abs(self.f(x_next))
-                return root(x_next, abs_dif, i, "Модифицированный метод Ньютона")
-            i += 1
+                return root(x_next, abs_dif, i, "Модифицированный метод Ньютона", **self.eval_stats(since))
             x_cur = x_next
+
+        return root(x_cur, abs(self.f(x_cur)), self.max_iter, "Модифицированный метод Ньютона",
+                    **self.eval_stats(since), stop_reason="max_iter")
     
+    @_instrument_solver
     def secant(self, section: interval):
+        since = self.counters()
         a = section.start
         b = section.end
-        i: int = 1
-        while True:
+        for i in range(1, self.max_iter + 1):
+            if self.f(a) == self.f(b):
+                return root(b, abs(self.f(b)), i, "Метод секущих", **self.eval_stats(since),
+                            stop_reason="zero_derivative")
             a = a - (b - a) * self.f(a) / (self.f(b) - self.f(a))
+            if self.f(a) == self.f(b):
+                return root(a, abs(self.f(a)), i, "Метод секущих", **self.eval_stats(since),
+                            stop_reason="zero_derivative")
             b = b - (a - b) * self.f(b) / (self.f(a) - self.f(b))
+            if profiling.tracing:
+                profiling.trace(x=b)
             if abs(a - b) <= self.eps:
                 abs_dif = abs(self.f(b))
-                return root(b, abs_dif, i, "Метод секущих")
-            i += 1
+                return root(b, abs_dif, i, "Метод секущих", **self.eval_stats(since))
+
+        return root(b, abs(self.f(b)), self.max_iter, "Метод секущих", **self.eval_stats(since),
+                    stop_reason="max_iter")
+
+    # Brent's method: keeps the sign-change bracket [b, c] and takes inverse quadratic interpolation
+    # or secant steps, falling back to bisection whenever they do not shrink the bracket fast enough
+    @_instrument_solver
+    def brent(self, section: interval) -> root:
+        since = self.counters()
+        method = "Гибридный метод Брента"
+        a, b = section.start, section.end
+        fa, fb = self.f(a), self.f(b)
+        evals = 2
+        if fa * fb > 0:
+            return root(b, abs(fb), 0, method, **self.eval_stats(since), stop_reason="no_bracket")
+
+        c, fc = a, fa
+        d = e = b - a
+        for i in range(1, self.max_iter + 1):
+            if fb * fc > 0:
+                c, fc = a, fa
+                d = e = b - a
+            # b is always the best approximation, c keeps the opposite sign
+            if abs(fc) < abs(fb):
+                a, b, c = b, c, b
+                fa, fb, fc = fb, fc, fb
+
+            tol = 2 * sys.float_info.epsilon * abs(b) + self.eps / 2
+            m = (c - b) / 2
+            if abs(m) <= tol or fb == 0:
+                return root(b, abs(fb), i, method, abs(c - b), **self.eval_stats(since))
+
+            if abs(e) >= tol and abs(fa) > abs(fb):
+                s = fb / fa
+                if a == c:
+                    # secant step
+                    p = 2 * m * s
+                    q = 1 - s
+                else:
+                    # inverse quadratic interpolation
+                    q = fa / fc
+                    r = fb / fc
+                    p = s * (2 * m * q * (q - r) - (b - a) * (r - 1))
+                    q = (q - 1) * (r - 1) * (s - 1)
+                if p > 0:
+                    q = -q
+                p = abs(p)
+
+                if 2 * p < min(3 * m * q - abs(tol * q), abs(e * q)):
+                    e, d = d, p / q
+                else:
+                    e = d = m
+            else:
+                e = d = m
+
+            if evals >= self.max_evals:
+                return root(b, abs(fb), i, method, abs(c - b), **self.eval_stats(since), stop_reason="max_evals")
+
+            a, fa = b, fb
+            b += d if abs(d) > tol else math.copysign(tol, m)
+            fb = self.f(b)
+            evals += 1
+            if profiling.tracing:
+                profiling.trace(x=b)
+
+        return root(b, abs(fb), self.max_iter, method, abs(c - b), **self.eval_stats(since), stop_reason="max_iter")
+
+    # refines every (section, method) pair in a pool of workers, each worker owns a clone of the finder;
+    # res[i][j] is the result of methods[j] on sections[i] regardless of the number of workers
+    def refine_parallel(self, sections: List[interval], methods: Sequence[str] = methods, workers: int = None,
+                        chunk_size: int = 1, use_threads: bool = False) -> List[List[root]]:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        import multiprocessing as mp
+
+        jobs = [(section.start, section.end, method) for section in sections for method in methods]
+        if use_threads:
+            executor = ThreadPoolExecutor(workers, initializer=_init_refine_worker, initargs=(self,))
+        else:
+            # fork lets workers inherit f and df, so lambdas do not have to be picklable
+            ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+            executor = ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_refine_worker, initargs=(self,))
+
+        with executor:
+            results = list(executor.map(_refine_job, jobs, chunksize=chunk_size))
+
+        return [results[i:i + len(methods)] for i in range(0, len(results), len(methods))]
 
     def draw(self) -> None:
+        import matplotlib.pyplot as plt
+
         start = self.section.start
         end =  self.section.end
         x = np.linspace(start, end, 100)
-        y = [self.f(t) for t in x]
+        y = self.eval_many(x)
         plt.plot(x, y, color='red')
         plt.axhline(0, color='black')
         plt.axvline(0, color='black')
@@ -133,16 +478,151 @@ class root_finder:
         plt.pause(0.001)
 
 
+# roots of a whole family of equations, one entry per instance
+class roots:
+    def __init__(self, val: np.ndarray, abs_dif: np.ndarray, iterations: np.ndarray, stop_reason: np.ndarray,
+                 method: str) -> None:
+        self.val = val
+        self.abs_dif = abs_dif
+        self.iterations = iterations
+        self.stop_reason = stop_reason
+        self.method = method
+
+    @property
+    def converged(self) -> np.ndarray:
+        return self.stop_reason == "converged"
+
+    def __len__(self) -> int:
+        return len(self.val)
+
+    def __getitem__(self, i: int) -> root:
+        return root(float(self.val[i]), float(self.abs_dif[i]), int(self.iterations[i]), self.method,
+                    stop_reason=str(self.stop_reason[i]))
+
+
+# solves f(x, p) = 0 for many parameter values p at once; f and df must accept arrays of x and p,
+# instances that have converged or diverged drop out of the following iterations
+class batch_root_finder:
+    def __init__(self, f: Callable, df: Callable, eps: float, max_iter: int = 500) -> None:
+        self.f = f
+        self.df = df
+        self.eps = eps
+        self.max_iter = max_iter
+
+    def eval(self, func: Callable, x: np.ndarray, params, idx: np.ndarray) -> np.ndarray:
+        if params is None:
+            return np.asarray(func(x), dtype=float)
+        return np.asarray(func(x, params[idx]), dtype=float)
+
+    def newton(self, x0, params=None) -> roots:
+        x = np.array(x0, dtype=float)
+        params = np.asarray(params) if params is not None else None
+        its = np.zeros(len(x), dtype=int)
+        stop_reason = np.full(len(x), "max_iter", dtype=object)
+
+        active = np.arange(len(x))
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            for _ in range(self.max_iter):
+                if active.size == 0:
+                    break
+                x_cur = x[active]
+                step = self.eval(self.f, x_cur, params, active) / self.eval(self.df, x_cur, params, active)
+                x_next = x_cur - step
+                its[active] += 1
+
+                finite = np.isfinite(x_next)
+                done = np.abs(step) <= self.eps
+                x[active[finite]] = x_next[finite]
+                stop_reason[active[~finite]] = "diverged"
+                stop_reason[active[done & finite]] = "converged"
+                active = active[finite & ~done]
+
+        abs_dif = np.abs(self.eval(self.f, x, params, np.arange(len(x))))
+        return roots(x, abs_dif, its, stop_reason, "Метод Ньютона")
+
+    def secant(self, x0, x1, params=None) -> roots:
+        x_prev = np.array(x0, dtype=float)
+        x = np.array(x1, dtype=float)
+        params = np.asarray(params) if params is not None else None
+        its = np.zeros(len(x), dtype=int)
+        stop_reason = np.full(len(x), "max_iter", dtype=object)
+
+        active = np.arange(len(x))
+        f_prev = self.eval(self.f, x_prev, params, active)
+        f_cur = self.eval(self.f, x, params, active)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            for _ in range(self.max_iter):
+                if active.size == 0:
+                    break
+                x_cur = x[active]
+                step = f_cur * (x_cur - x_prev[active]) / (f_cur - f_prev)
+                x_next = x_cur - step
+                its[active] += 1
+
+                finite = np.isfinite(x_next)
+                done = np.abs(step) <= self.eps
+                x_prev[active[finite]] = x_cur[finite]
+                x[active[finite]] = x_next[finite]
+                stop_reason[active[~finite]] = "diverged"
+                stop_reason[active[done & finite]] = "converged"
+
+                keep = finite & ~done
+                f_prev = f_cur[keep]
+                active = active[keep]
+                f_cur = self.eval(self.f, x[active], params, active)
+
+        abs_dif = np.abs(self.eval(self.f, x, params, np.arange(len(x))))
+        return roots(x, abs_dif, its, stop_reason, "Метод секущих")
+
+
+_worker = threading.local()
+
+
+def _init_refine_worker(finder: root_finder) -> None:
+    _worker.finder = finder.clone()
+
+
+def _refine_job(job) -> root:
+    start, end, method = job
+    finder = _worker.finder
+    # jobs start from an empty cache so the reported counters do not depend on scheduling
+    finder.f.clear()
+    if finder.df is not None:
+        finder.df.clear()
+    return getattr(finder, method)(interval(start, end))
+
+
+# [A, B] = [-5 ,10]
+def equation():
+    f = function(lambda x: pow(2, -x) - math.sin(x), "2^(-x) - sin(x)",
+                 vf=lambda x: np.power(2.0, -x) - np.sin(x))
+    df = function(lambda x: -pow(2, -x) * math.log(2) - math.cos(x), "-2^(-x) * ln(2) - cos(x)",
+                  vf=lambda x: -np.power(2.0, -x) * math.log(2) - np.cos(x))
+    return f, df
+
+
+# one job of the batch mode, e.g. {"left": -5, "right": 10, "steps": 1000, "eps": 1e-10, "methods": ["brent"]}:
+# a record per root section and method
+def batch_job(job: dict):
+    f, df = equation()
+    rt = root_finder(f, df, interval(job["left"], job["right"]), job["steps"], job.get("eps", 1e-10))
+    for section in rt.get_root_sections():
+        for method in job.get("methods", root_finder.methods):
+            res = getattr(rt, method)(section)
+            yield dict(start=section.start, end=section.end, method=method, root=res.val, abs_dif=res.abs_dif,
+                       iterations=res.iterations, f_evals=res.f_evals, df_evals=res.df_evals,
+                       stop_reason=res.stop_reason)
+
+
 def main():
-    # [A, B] = [-5 ,10]
-    f = lambda x: pow(2, -x) - math.sin(x)
-    df = lambda x: -pow(2, -x) * math.log(2) - math.cos(x)
+    f, df = equation()
     print("Программа для нахождения корней трансцендетного уравнения: 2^(-x) - sin(x) = 0\n")
     print("Доступные методы: \n"\
         "Метод половинного деления (бисекции)\n"
         "Метод Ньютона\n"\
         "Усовершенствованный метод Ньютона\n"
-        "Метод секущих\n")
+        "Метод секущих\n"
+        "Гибридный метод Брента\n")
 
     while True:
         left = float(input("Введите левый конец отрезка: "))
@@ -181,6 +661,8 @@ def main():
             # time.sleep(1.5)
             print(rt.secant(cur_sect))
             print(f"------------------------------------------------------\n")
+            print(rt.brent(cur_sect))
+            print(f"------------------------------------------------------\n")
             [print(f"{i + 1}. {section.__str__(precision)}") for i, section in enumerate(rt.get_root_sections())]
         
         doContinue = int(input("Хотите повторить ввод: 1 - Да, 0 - Нет: "))
@@ -189,5 +671,9 @@ def main():
         
     
 # params usage: cat params | python3 main.py
+# batch usage: python3 main.py --batch jobs.json [--format csv] [--out results.csv]
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        run_batch(batch_job)
+    else:
+        main()
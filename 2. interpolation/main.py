@@ -1,38 +1,193 @@
-import matplotlib.pyplot as plt
+from collections import OrderedDict
 import numpy as np
 import math
-import tabulate as tb
 import itertools
-import operator
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import function, evaluate, instrument, run_batch
+
+
+# Lagrange polynomial in the barycentric form: the weights and function values are computed
+# once for the given nodes, after that the polynomial costs O(n) per point
+class lagrange_poly:
+    def __init__(self, nodes, vals):
+        self.nodes = np.asarray(nodes, dtype=float)
+        self.vals = np.asarray(vals, dtype=float)
+        diffs = self.nodes[:, None] - self.nodes[None, :]
+        np.fill_diagonal(diffs, 1)
+        self.weights = 1 / diffs.prod(axis=1)
+
+    def __call__(self, x):
+        xs = np.atleast_1d(np.asarray(x, dtype=float))
+        diffs = xs[:, None] - self.nodes[None, :]
+        # at the nodes themselves the polynomial takes the tabulated values
+        exact = diffs == 0
+        diffs[exact] = 1
+        terms = self.weights / diffs
+        res = terms @ self.vals / terms.sum(axis=1)
+        rows, cols = np.nonzero(exact)
+        res[rows] = self.vals[cols]
+        return res if np.ndim(x) else float(res[0])
+
+
+# Newton form of the interpolation polynomial; nodes are added one at a time and each new node
+# costs O(n): only the new diagonal of the divided-difference table is computed
+class newton_poly:
+    def __init__(self):
+        self.nodes = []
+        # coeffs[n] = f[x_0, ..., x_n]
+        self.coeffs = []
+        # diag[j] = f[x_{n-j}, ..., x_n] for the last added node x_n
+        self.diag = []
+
+    def degree(self) -> int:
+        return len(self.nodes) - 1
+
+    def add_node(self, x, y):
+        diag = [y]
+        for j in range(len(self.nodes)):
+            diag.append((diag[j] - self.diag[j]) / (x - self.nodes[-1 - j]))
+        self.nodes.append(x)
+        self.diag = diag
+        self.coeffs.append(diag[-1])
+
+    # terms f[x_0, ..., x_n] * (x - x_0) ... (x - x_{n-1}) of the polynomial, their prefix sums
+    # are the polynomials of every lower degree
+    def terms(self, x):
+        res = []
+        prod = 1
+        for node, coeff in zip(self.nodes, self.coeffs):
+            res.append(coeff * prod)
+            prod = prod * (x - node)
+        return res
+
+    # Horner scheme on the first degree + 1 coefficients, x may be a number or an array of points
+    def __call__(self, x, degree: int = None):
+        degree = self.degree() if degree is None else degree
+        res = self.coeffs[degree]
+        for i in range(degree - 1, -1, -1):
+            res = res * (x - self.nodes[i]) + self.coeffs[i]
+        return res
+
+
+# bounded LRU cache of per-window interpolation polynomials
+class window_cache:
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build):
+        if key in self.items:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key]
+
+        self.misses += 1
+        value = self.items[key] = build()
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self) -> dict:
+        return dict(size=len(self.items), hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+# instrumentation of the interpol entry points: they work on the table, so only the window cache is counted
+def _cache_counters(inter) -> dict:
+    stats = inter.cache.stats()
+    return dict(cache_hits=stats["hits"], cache_misses=stats["misses"])
+
+
+_instrument_table = instrument(functions=(), counters=_cache_counters)
 
 
 class interpol:
-    def __init__(self, f, start, end, num_nodes):
+    def __init__(self, f, start, end, num_nodes, cache_size: int = 1024):
         self.f = f
-        self.nodes = list(np.linspace(start, end, num_nodes))
+        self.cache = window_cache(cache_size)
         self.interp_nodes = None
-        self.degree = None
+        self._degree = None
+        self.poly = None
+        # Newton form on the nodes nearest to newton_x, reused while the point stays the same
+        self.newton = None
+        self.newton_x = None
+        if num_nodes is not None:
+            nodes = np.linspace(start, end, num_nodes)
+            self.set_table(nodes, evaluate(f, nodes))
+
+    # table of sorted nodes and function values given as arrays, f is not needed to interpolate
+    @classmethod
+    def from_table(cls, nodes, vals, f=None, cache_size: int = 1024):
+        inter = cls(f, None, None, None, cache_size)
+        inter.set_table(nodes, vals)
+        return inter
+
+    # table saved by save(); with mmap the nodes and values are read from disk on demand, without a copy
+    @classmethod
+    def load(cls, path, f=None, mmap: bool = True, cache_size: int = 1024):
+        table = np.load(path, mmap_mode="r" if mmap else None)
+        return cls.from_table(table[0], table[1], f, cache_size)
+
+    # saves the table as a (2, M) .npy array: nodes in the first row, values in the second
+    def save(self, path):
+        table = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(2, len(self.nodes)))
+        table[0] = self.nodes
+        table[1] = self.vals
+        table.flush()
+
+    def set_table(self, nodes, vals):
+        nodes = np.asarray(nodes, dtype=np.float64)
+        vals = np.asarray(vals, dtype=np.float64)
+        if nodes.shape != vals.shape or nodes.ndim != 1:
+            raise ValueError("nodes and values must be one-dimensional arrays of the same length")
+        self.nodes = nodes
+        self.vals = vals
+        self.cache.clear()
+        self.newton = None
+
+    @property
+    def degree(self):
+        return self._degree
+
+    # windows of another size make the cached polynomials useless
+    @degree.setter
+    def degree(self, value):
+        if value != self._degree:
+            self.cache.clear()
+        self._degree = value
 
     # prints table with function value in given number of points
     def print_nodes(self):
-        self.print_table(self.nodes)
+        self.print_table(self.nodes, self.vals)
 
     # prints table with sorted points used for interpolation polynom
     def print_interp_nodes(self, x):
-        points = self.get_knn(x, self.degree + 1)
-        self.print_table(points)
+        idx = self.get_knn_idx(x, self.degree + 1)
+        self.print_table(self.nodes[idx], self.vals[idx])
 
     # prints table with function value in given points
-    def print_table(self, points):
-        vals = [self.f(t) for t in points]
-        table = (['x'] + points, ['y'] + vals)
+    @instrument(functions=())
+    def print_table(self, points, vals):
+        import tabulate as tb
+
+        table = (['x'] + list(points), ['y'] + list(vals))
         print(tb.tabulate(table, floatfmt=".2f", tablefmt="fancy_grid", numalign="center"))
 
     def draw(self):
-        f_vals = [self.f(t) for t in self.nodes]
-        plt.plot(self.nodes, f_vals, 'o-', linewidth=1.5, label="ln(1 + x)")
+        import matplotlib.pyplot as plt
+
+        plt.plot(self.nodes, self.vals, 'o-', linewidth=1.5, label="ln(1 + x)")
 
-        L_vals = [self.L_poly(t) for t in self.nodes]
+        L_vals = self.L_poly(self.nodes)
         plt.plot(self.nodes, L_vals, 'o-', linewidth=1.5, label="L(x)")
 
         plt.axhline(0, color='gray', linewidth=1.5)
@@ -40,40 +195,124 @@ class interpol:
         plt.legend()
         plt.show(block=False)
 
+    # first indices of the windows of k consecutive nodes nearest to every point of xs:
+    # binary search for the position of x, then the window grows towards the closer neighbour
+    # (the left one on ties), O(log M + k) per point
+    def windows(self, xs: np.ndarray, k: int) -> np.ndarray:
+        nodes = self.nodes
+        hi = np.searchsorted(nodes, xs, side="left")
+        lo = hi.copy()
+        for _ in range(k):
+            take_left = (lo > 0) & ((hi == len(nodes)) |
+                                    (xs - nodes[lo - 1] <= nodes[np.minimum(hi, len(nodes) - 1)] - xs))
+            lo -= take_left
+            hi += ~take_left
+        return lo
+
+    # indices of the k nearest nodes sorted by distance to x
+    def get_knn_idx(self, x: float, k: int):
+        start = self.windows(np.array([x], dtype=float), k)[0]
+        return sorted(range(start, start + k), key=lambda i: abs(x - self.nodes[i]))
+
+    # k nearest nodes sorted by distance to x
     def get_knn(self, x: float, k: int):
-        dist_and_points = [(t, abs(x - t)) for t in self.nodes]
-        dist_and_points.sort(key=lambda x: x[1])
-        return [tup[0] for tup in dist_and_points[:k]]
+        return [self.nodes[i] for i in self.get_knn_idx(x, k)]
+
+    # polynomial built on the window of degree + 1 nodes starting at the given index
+    def window_poly(self, start: int) -> lagrange_poly:
+        end = start + self.degree + 1
+        return self.cache.get((start, self.degree), lambda: lagrange_poly(self.nodes[start:end], self.vals[start:end]))
 
+    @_instrument_table
     def interpolate(self, x: float) -> float:
-        self.interp_nodes = self.get_knn(x, self.degree + 1)
+        start = self.windows(np.array([x], dtype=float), self.degree + 1)[0]
+        self.interp_nodes = sorted(self.nodes[start:start + self.degree + 1], key=lambda t: abs(x - t))
+        self.poly = self.window_poly(start)
         return self.L_poly(x)
 
-    def mul(self, x, nodes_, exclude: int = None):
-        nodes = nodes_.copy()
-        if exclude is not None:
-            nodes.pop(exclude)
-        diffs = [x - t for t in nodes]
-        res = 1
-        if len(diffs) > 1:
-            *_, res = itertools.accumulate(diffs, operator.mul)
-        return 1 if len(diffs) == 0 else res
-
-    def fund_poly(self, x, nodes, exclude):
-        left = self.mul(x, nodes, exclude)
-        right = self.mul(nodes[exclude], nodes, exclude)
-        return left / right
+    # interpolates at every point of xs; queries are grouped by their node window,
+    # so the barycentric weights of every window are computed only once
+    @_instrument_table
+    def interpolate_many(self, xs) -> np.ndarray:
+        xs = np.asarray(xs, dtype=float)
+        k = self.degree + 1
+        win_starts, inverse = np.unique(self.windows(xs, k), return_inverse=True)
 
-    def L_poly(self, x):
-        nodes = self.interp_nodes
-        fund_vals = [self.f(nodes[i]) * self.fund_poly(x, nodes, i) for i in range(self.degree + 1)]
-        *_, res = itertools.accumulate(fund_vals, operator.add)
+        idx = win_starts[:, None] + np.arange(k)
+        win_nodes = self.nodes[idx]
+        diffs = win_nodes[:, :, None] - win_nodes[:, None, :]
+        diffs[:, np.arange(k), np.arange(k)] = 1
+        weights = 1 / diffs.prod(axis=2)
+
+        diffs = xs[:, None] - win_nodes[inverse]
+        exact = diffs == 0
+        diffs[exact] = 1
+        terms = weights[inverse] / diffs
+        vals = self.vals[idx][inverse]
+        res = (terms * vals).sum(axis=1) / terms.sum(axis=1)
+        rows, cols = np.nonzero(exact)
+        res[rows] = vals[rows, cols]
         return res
 
+    # Newton form on the degree + 2 nodes nearest to x, nearest first. For the same x the divided
+    # differences are kept, so raising the degree by one only adds one node, and lowering it
+    # just takes fewer terms. Returns the value of the polynomial of the current degree and
+    # the next term as its error estimate (None when the table has no more nodes).
+    @_instrument_table
+    def interpolate_newton(self, x: float):
+        if self.newton is None or self.newton_x != x:
+            self.newton = newton_poly()
+            self.newton_x = x
+
+        num = min(self.degree + 2, len(self.nodes))
+        for i in self.get_knn_idx(x, num)[len(self.newton.nodes):]:
+            self.newton.add_node(self.nodes[i], self.vals[i])
+
+        terms = self.newton.terms(x)
+        val = sum(terms[:self.degree + 1])
+        err = abs(terms[self.degree + 1]) if num > self.degree + 1 else None
+        return val, err
+
+    # values and error estimates of the polynomials of degrees 1..max_degree at x, O(max_degree^2) in total;
+    # a table of M nodes gives polynomials up to the degree M - 1
+    @_instrument_table
+    def degree_sweep(self, x: float, max_degree: int):
+        if max_degree >= len(self.nodes):
+            raise ValueError(f"max_degree must be less than the number of nodes ({len(self.nodes)})")
+        poly = newton_poly()
+        for i in self.get_knn_idx(x, min(max_degree + 2, len(self.nodes))):
+            poly.add_node(self.nodes[i], self.vals[i])
+
+        terms = poly.terms(x)
+        vals = list(itertools.accumulate(terms))
+        return [(n, vals[n], abs(terms[n + 1]) if n + 1 < len(terms) else None) for n in range(1, max_degree + 1)]
+
+    # polynomial of the last interpolate call, x may be a number or an array of points
+    def L_poly(self, x):
+        return self.poly(x)
+
+
+def variant_function():
+    return function(lambda x: math.log1p(x), "ln(1 + x)", vf=np.log1p)
+
+
+# one job of the batch mode, e.g. {"left": 0, "right": 1, "num_nodes": 100, "degree": 5, "points": [0.25, 0.5]}:
+# a record per point with the value of the polynomial and its absolute error
+def batch_job(job: dict):
+    f = variant_function()
+    inter = interpol(f, job["left"], job["right"], job["num_nodes"])
+    inter.degree = job["degree"]
+    xs = np.asarray(job["points"], dtype=float)
+    vals = inter.interpolate_many(xs)
+    for x, val, exact in zip(xs.tolist(), vals.tolist(), evaluate(f, xs).tolist()):
+        yield dict(x=x, value=val, abs_error=abs(val - exact))
+
 
 def main():
+    import matplotlib.pyplot as plt
+
     print("\n""Программа для алгебраического интерполирования функции ln(1 + x). Вариант №2\n")
-    f = lambda x: math.log1p(x)
+    f = variant_function()
     while True:
         left = float(input("Введите левый конец отрезка: "))
         right = float(input("Введите правый конец отрезка: "))
@@ -96,6 +335,9 @@ def main():
 
                 print(f"Значение интерполяционного многочлена в точке x: {val}\n")
                 print(f"Абсолютная погрешность: {abs(val - f(x))}\n")
+                _, err = inter.interpolate_newton(x)
+                if err is not None:
+                    print(f"Оценка погрешности по следующему члену формы Ньютона: {err}\n")
                 plt.close()
                 inter.draw()
                 print("\n""Доступные опции:\n"
@@ -120,6 +362,10 @@ def main():
 
 
 # params usage: cat params | python3 main.py
+# batch usage: python3 main.py --batch jobs.json [--format csv] [--out results.csv]
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        run_batch(batch_job)
+    else:
+        main()
 
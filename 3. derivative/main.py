@@ -1,18 +1,149 @@
-from typing import Callable, List
-import matplotlib.pyplot as plt
-import tabulate as tb
+from typing import Callable, List, Tuple
+import numpy as np
+import functools
+import itertools
 import math
-
-
-class function:
-    def __init__(self, f: Callable[[float], float], f_str):
-        self.f_str = f_str
-        self.f: Callable[[float], float] = f
-        self.df: Callable[[float], float] = None
-        self.d2f: Callable[[float], float] = None
-
-    def __call__(self, x) -> float:
-        return self.f(x)
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import function, evaluate, instrument, profiling, run_batch
+
+
+# Fornberg's algorithm: finite-difference weights at the points z for the derivatives of orders
+# 0..max_deriv on arbitrary distinct nodes x; z has shape (B,), x has shape (B, n), the result
+# has shape (B, max_deriv + 1, n) and res[b, k] are the weights of the k-th derivative at z[b]
+def fd_weights(z, x, max_deriv: int) -> np.ndarray:
+    z = np.asarray(z, dtype=float)
+    x = np.asarray(x, dtype=float)
+    n = x.shape[1]
+    c = np.zeros((len(z), max_deriv + 1, n))
+    c[:, 0, 0] = 1
+    c1 = np.ones(len(z))
+    c4 = x[:, 0] - z
+    for i in range(1, n):
+        mn = min(i, max_deriv)
+        c2 = np.ones(len(z))
+        c5 = c4
+        c4 = x[:, i] - z
+        for j in range(i):
+            c3 = x[:, i] - x[:, j]
+            c2 = c2 * c3
+            if j == i - 1:
+                for k in range(mn, 0, -1):
+                    c[:, k, i] = c1 * (k * c[:, k - 1, i - 1] - c5 * c[:, k, i - 1]) / c2
+                c[:, 0, i] = -c1 * c5 * c[:, 0, i - 1] / c2
+            for k in range(mn, 0, -1):
+                c[:, k, j] = (c4 * c[:, k, j] - k * c[:, k - 1, j]) / c3
+            c[:, 0, j] = c4 * c[:, 0, j] / c3
+        c1 = c2
+    return c
+
+
+# memoized weights of the derivative of order deriv at 0 on nodes at the given offsets (in steps),
+# for a step h they are divided by h^deriv
+@functools.lru_cache(maxsize=None)
+def stencil_weights(deriv: int, offsets: Tuple[float, ...]) -> np.ndarray:
+    weights = fd_weights([0.0], [offsets], deriv)[0, deriv]
+    weights.flags.writeable = False
+    return weights
+
+
+# number of points of the central stencil and of the one-sided ones for the derivative of order
+# deriv with the error O(h^accuracy), accuracy has to be even
+def stencil_sizes(deriv: int, accuracy: int) -> Tuple[int, int]:
+    return 2 * ((deriv + 1) // 2) - 1 + accuracy, deriv + accuracy
+
+
+# derivative of order deriv with the error O(h^accuracy) on a non-uniform grid: every node uses
+# the deriv + accuracy nodes around it (shifted inside the table near the ends)
+def nonuniform_derivs(nodes, vals, deriv: int, accuracy: int = 2) -> np.ndarray:
+    nodes = np.asarray(nodes, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    size = deriv + accuracy
+    if size > len(nodes):
+        raise ValueError(f"at least {size} nodes are needed")
+
+    starts = np.clip(np.arange(len(nodes)) - (size - 1) // 2, 0, len(nodes) - size)
+    idx = starts[:, None] + np.arange(size)
+    weights = fd_weights(nodes, nodes[idx], deriv)[:, deriv]
+    return (weights * vals[idx]).sum(axis=1)
+
+
+# derivative of order deriv with the error O(h^accuracy) at every point of the uniform samples vals;
+# the weights come from the memoized Fornberg table: the central stencil is applied to the interior
+# as shifted slices, the points near an end of the data use deriv + accuracy one-sided points.
+# With left_end/right_end unset that end is an open cut of a longer signal and the points whose
+# central stencil does not fit are left as NaN.
+def stencil_derivs(vals, step, deriv: int, accuracy: int = 2, left_end: bool = True, right_end: bool = True):
+    num = len(vals)
+    central, one_sided = stencil_sizes(deriv, accuracy)
+    half = central // 2
+    if num < max(central, one_sided):
+        raise ValueError(f"at least {max(central, one_sided)} nodes are needed")
+
+    res = np.full(num, np.nan)
+    res[half:num - half] = 0
+    offsets = tuple(range(-half, half + 1))
+    for offset, weight in zip(offsets, stencil_weights(deriv, offsets)):
+        if weight != 0:
+            res[half:num - half] += weight * vals[half + offset:num - half + offset]
+
+    ends = itertools.chain(range(half) if left_end else (), range(num - half, num) if right_end else ())
+    for i in ends:
+        first = -i if i < half else num - i - one_sided
+        offsets = tuple(range(first, first + one_sided))
+        res[i] = np.dot(stencil_weights(deriv, offsets), vals[i + first:i + first + one_sided])
+
+    return res / step ** deriv
+
+
+# derivatives of a long uniformly sampled signal, computed chunk by chunk with bounded memory.
+# samples is an iterable of 1-D chunks (e.g. a generator reading a file) or an array, possibly
+# memory-mapped, which is read chunk_size samples at a time. Every chunk is joined with a halo of
+# the previous samples, so the stencils across the joins are the same as on the whole signal and
+# the one-sided formulas are only used at its global ends. Yields derivative chunks in order.
+def stream_derivs(samples, step, deriv: int = 1, accuracy: int = 2, chunk_size: int = 1 << 20):
+    if isinstance(samples, np.ndarray):
+        signal = samples
+        samples = (signal[i:i + chunk_size] for i in range(0, len(signal), chunk_size))
+
+    central, one_sided = stencil_sizes(deriv, accuracy)
+    half = central // 2
+    # samples needed behind the first point not yet computed
+    reach = max(half, one_sided)
+
+    chunks = iter(samples)
+    buf = np.empty(0)
+    # global indices of buf[0] and of the next derivative to yield
+    start = emitted = 0
+    nxt = next(chunks, None)
+    while nxt is not None:
+        buf = np.concatenate((buf, np.asarray(nxt, dtype=float)))
+        nxt = next(chunks, None)
+        last = nxt is None
+        if not last and len(buf) < reach + central:
+            continue
+
+        res = stencil_derivs(buf, step, deriv, accuracy, left_end=start == 0, right_end=last)
+        end = len(buf) if last else len(buf) - half
+        if end > emitted - start:
+            yield res[emitted - start:end]
+            emitted = start + end
+
+        keep = max(emitted - reach - start, 0)
+        buf = buf[keep:]
+        start += keep
+
+
+# Richardson tableau for every node: tableau[l, j, i], errors[l - 1, i] = |T[l, l] - T[l-1, l-1]|
+# in node i, best is the level with the smallest error estimate
+class extrapolation:
+    def __init__(self, tableau, errors, best: int):
+        self.tableau = tableau
+        self.errors = errors
+        self.best_level = best
+        self.best = tableau[best, best]
 
 
 class diff:
@@ -21,78 +152,118 @@ class diff:
         self.start = start
         self.step = step
         self.num_vals = num_vals
-        self.nodes = [self.start + self.step * i for i in range(self.num_vals)]
-        self.f_vals = [self.f(t) for t in self.nodes]
+        self.nodes = self.start + self.step * np.arange(self.num_vals)
+        self.f_vals = evaluate(self.f, self.nodes)
+        # samples on the table refined by halving the step, levels[0] is the table itself
+        self.levels = [self.f_vals]
 
+    @instrument()
     def print_f(self):
-        table = (['x'] + self.nodes, ['y'] + self.f_vals)
+        import tabulate as tb
+
+        table = (['x'] + list(self.nodes), ['y'] + list(self.f_vals))
         print(tb.tabulate(table, floatfmt=".3f", stralign='center', tablefmt="fancy_grid"))
 
+    @instrument()
     def print_res_table(self):
+        import tabulate as tb
+
         table_labels = ("№", "x", "f(x)", "f'(x) ± O(h^2)", "Погрешность O(h^2)",
                     "f'(x) ± O(h^4)", "Погрешность O(h^4)",
                     "f\"(x)", "Погрешность")
 
-        table = [[i + 1, self.nodes[i], self.f_vals[i], 
-                  *self.first_deriv_h2(i, self.step, self.nodes, self.f_vals),
-                  *self.first_deriv_h4(i, self.step, self.nodes, self.f_vals),
-                  *self.second_deriv(i, self.step, self.nodes, self.f_vals)] for i in range(len(self.nodes))]
+        columns = self.res_table()
+        table = [[i + 1, self.nodes[i], self.f_vals[i], *(col[i] for col in columns)] for i in range(len(self.nodes))]
 
         print(tb.tabulate(table, headers=table_labels, floatfmt=("e",".3f"), tablefmt="fancy_grid", numalign='center'))
 
-    def first_deriv_h2(self, index: int, step, nodes, vals):
-        if index == 0:
-            df = (-3 * vals[index] + 4 * vals[index + 1] - vals[index + 2]) / (2 * step)
-        elif index == len(nodes) - 1:
-            df = (3 * vals[index] - 4 * vals[index - 1] + vals[index - 2]) / (2 * step)
-        else:
-            df = (vals[index + 1] - vals[index - 1]) / (2 * step)
-
-        return df, abs(df - self.f.df(nodes[index]))
-
-    def first_deriv_h4(self, index: int, step, nodes, vals):
-        if index == 0:
-            df = (-25 * vals[0] + 48 * vals[1] - 36 * vals[2]
-                  + 16 * vals[3] - 3 * vals[4]) / (12 * step)
-
-        elif index == 1:
-            df = (-3 * vals[0] - 10 * vals[1] + 18 * vals[2]
-                - 6 * vals[3] + vals[4]) / (12 * step)
-
-        elif index == len(nodes) - 2:
-            df = (3 * vals[-1] + 10 * vals[-2] - 18 * vals[-3]
-                + 6 * vals[-4] - vals[-5]) / (12 * step)
-
-        elif index == len(nodes) - 1:
-            df = (25 * vals[-1] - 48 * vals[-2] + 36 * vals[-3]
-                - 16 * vals[-4] + 3 * vals[-5]) / (12 * step)
-
-        else:
-            df = (vals[index - 2] - 8 * vals[index - 1] + 8 * vals[index + 1]
-                - vals[index + 2]) / (12 * step)
-
-        return df, abs(df - self.f.df(nodes[index]))
+    # derivatives and their errors in every node of the table:
+    # f'(x) ± O(h^2), error, f'(x) ± O(h^4), error, f"(x), error
+    @instrument()
+    def res_table(self):
+        df = evaluate(self.f.df, self.nodes)
+        d2f = evaluate(self.f.d2f, self.nodes)
+
+        df_h2 = self.first_derivs_h2(self.step, self.f_vals)
+        df_h4 = self.first_derivs_h4(self.step, self.f_vals)
+        d2f_h2 = self.second_derivs(self.step, self.f_vals)
+        return df_h2, np.abs(df_h2 - df), df_h4, np.abs(df_h4 - df), d2f_h2, np.abs(d2f_h2 - d2f)
+
+    # derivative of order deriv with the error O(h^accuracy) in every node, see stencil_derivs
+    def derivs(self, deriv: int, accuracy: int = 2, step=None, vals=None):
+        step = self.step if step is None else step
+        vals = self.f_vals if vals is None else vals
+        return stencil_derivs(vals, step, deriv, accuracy)
+
+    # the formulas of the table: f' with the errors O(h^2) and O(h^4), f" with O(h^2)
+    def first_derivs_h2(self, step, vals):
+        return stencil_derivs(vals, step, 1, 2)
+
+    def first_derivs_h4(self, step, vals):
+        return stencil_derivs(vals, step, 1, 4)
+
+    def second_derivs(self, step, vals):
+        return stencil_derivs(vals, step, 2, 2)
+
+    # samples of the table with the step halved `level` times; the nodes of a level are every other
+    # node of the next one, so each new level only evaluates f at the new midpoints
+    @instrument()
+    def refined_vals(self, level: int):
+        while len(self.levels) <= level:
+            prev = self.levels[-1]
+            step = self.step / 2 ** len(self.levels)
+            vals = np.empty(2 * len(prev) - 1)
+            vals[::2] = prev
+            mids = self.start + step * np.arange(1, len(vals), 2)
+            vals[1::2] = evaluate(self.f, mids)
+            self.levels.append(vals)
+        return self.levels[level]
+
+    # Richardson (Runge-Romberg) tableau for the first (order=1) or the second (order=2) derivative
+    # in every node of the table; tableau[l, j] uses the step h / 2^l and j extrapolations.
+    # Levels are added until the error estimate |T[l, l] - T[l-1, l-1]| drops below tol,
+    # stops decreasing or max_levels is reached.
+    @instrument(result=lambda res: dict(levels=len(res.tableau), best_level=res.best_level))
+    def richardson(self, order: int = 1, max_levels: int = 6, tol: float = 0.0) -> extrapolation:
+        derivs = self.first_derivs_h2 if order == 1 else self.second_derivs
+        num = len(self.nodes)
+        # the central formulas have an error expansion in even powers of h, the one-sided ones in all powers
+        central = np.ones(num, dtype=bool)
+        central[[0, -1]] = False
+
+        tableau = np.full((max_levels, max_levels, num), np.nan)
+        errors = []
+        best = 0
+        for level in range(max_levels):
+            tableau[level, 0] = derivs(self.step / 2 ** level, self.refined_vals(level))[::2 ** level]
+            for j in range(1, level + 1):
+                factor = 2.0 ** np.where(central, 2 * j, j + 1)
+                tableau[level, j] = (factor * tableau[level, j - 1] - tableau[level - 1, j - 1]) / (factor - 1)
+            if level == 0:
+                continue
+
+            errors.append(np.abs(tableau[level, level] - tableau[level - 1, level - 1]))
+            if profiling.tracing:
+                profiling.trace(level=level, error=float(errors[-1].max()))
+            if len(errors) > 1 and errors[-1].max() >= errors[-2].max():
+                break
+            best = level
+            if errors[-1].max() <= tol:
+                break
 
-    def second_deriv(self, index, step, nodes, vals):
-        if index == 0:
-            d2f = (2 * vals[0] - 5 * vals[1] + 4 * vals[2] - vals[3]) / (step ** 2)
-        elif index == len(nodes) - 1:
-            d2f = (2 * vals[-1] - 5 * vals[-2] + 4 * vals[-3] - vals[-4]) / (step ** 2)
-        else:
-            d2f = (vals[index + 1] - 2 * vals[index] + vals[index - 1]) / (step ** 2)
-        return d2f, abs(d2f - self.f.d2f(nodes[index]))
+        levels = len(errors) + 1
+        return extrapolation(tableau[:levels, :levels], np.array(errors), best)
 
+    @instrument()
     def runge(self, index):
-        cur_x = self.nodes[index]
-        doubled_nodes = [self.start + self.step / 2 * i for i in range(self.num_vals * 2 - 1)]
-        doubled_vals = [self.f(t) for t in doubled_nodes]
+        import tabulate as tb
 
-        J1_df, err_J1_df = self.first_deriv_h2(index, self.step, self.nodes, self.f_vals)
-        J2_df, err_J2_df = self.first_deriv_h2(index * 2, self.step / 2, doubled_nodes, doubled_vals)
-        J_df = (4 * J2_df - J1_df) / 3
+        cur_x = self.nodes[index]
+        table_df = self.richardson(1, max_levels=2).tableau[:, :, index]
+        J1_df, J2_df, J_df = table_df[0, 0], table_df[1, 0], table_df[1, 1]
 
         line_df = [[cur_x, self.f.df(cur_x), J1_df,
-                    err_J1_df, J2_df, err_J2_df, J_df,
+                    abs(J1_df - self.f.df(cur_x)), J2_df, abs(J2_df - self.f.df(cur_x)), J_df,
                     abs(J_df - self.f.df(cur_x))]]
 
         labels_df = ["x", "f'(x)", "J(h)", "Погрешность", "J(h/2)", "Погрешность", "J", "Погрешность"]
@@ -100,20 +271,21 @@ class diff:
         print(f"Уточнённые значения первой производной в точке x = {self.nodes[index]}:")
         print(tb.tabulate(line_df, headers=labels_df, numalign="center", floatfmt=(".3f", "e"), tablefmt="fancy_grid"))
 
-        J1_d2f, err_J1_d2f = self.second_deriv(index, self.step, self.nodes, self.f_vals)
-        J2_d2f, err_J2_d2f = self.second_deriv(index * 2, self.step / 2, doubled_nodes, doubled_vals)
-        J_d2f = (4 * J2_d2f - J1_d2f) / 3
+        table_d2f = self.richardson(2, max_levels=2).tableau[:, :, index]
+        J1_d2f, J2_d2f, J_d2f = table_d2f[0, 0], table_d2f[1, 0], table_d2f[1, 1]
         
         labels_d2f = ["x", "f\"(x)", "J(h)", "Погрешность", "J(h/2)", "Погрешность", "J", "Погрешность"]
 
         line_d2f = [[cur_x, self.f.d2f(cur_x), J1_d2f,
-                    err_J1_d2f, J2_d2f, err_J2_d2f, J_d2f,
+                    abs(J1_d2f - self.f.d2f(cur_x)), J2_d2f, abs(J2_d2f - self.f.d2f(cur_x)), J_d2f,
                     abs(J_d2f - self.f.d2f(cur_x))]]
 
         print("\n"f"Уточнённые значения второй производной в точке x = {cur_x}:")
         print(tb.tabulate(line_d2f, headers=labels_d2f, numalign="center", floatfmt=(".3f", "e"), tablefmt="fancy_grid"))
 
     def draw(self):
+        import matplotlib.pyplot as plt
+
         fig, (ax1, ax2) = plt.subplots(2)
         fig.set_size_inches(w=8, h=7)
 
@@ -122,14 +294,16 @@ class diff:
         self.draw_calc(ax2)
 
     def draw_exact(self, plot):
+        import matplotlib.pyplot as plt
+
         plot.set_title("Точные значения")
 
         plot.plot(self.nodes, self.f_vals, 'o-', linewidth=1.5, label=f"f(x) = {self.f.f_str}")
 
-        df_vals = [self.f.df(x) for x in self.nodes]
+        df_vals = evaluate(self.f.df, self.nodes)
         plot.plot(self.nodes, df_vals, 'o-', linewidth=1.5, label=f"f'(x) = {self.f.df.f_str}")
 
-        d2f_vals = [self.f.d2f(x) for x in self.nodes]
+        d2f_vals = evaluate(self.f.d2f, self.nodes)
         plot.plot(self.nodes, d2f_vals, 'o-', linewidth=1.5, label=f"f\"(x) = {self.f.d2f.f_str}")
 
         plot.axhline(0, color='gray', linewidth=1.5)
@@ -138,14 +312,16 @@ class diff:
         plt.show(block=False)
 
     def draw_calc(self, plot):
+        import matplotlib.pyplot as plt
+
         plot.set_title("Вычисленные значения")
 
         plot.plot(self.nodes, self.f_vals, 'o-', linewidth=1.5, label=f"f(x) = {self.f.f_str}")
 
-        df_vals = [self.first_deriv_h4(i, self.step, self.nodes, self.f_vals)[0] for i in range(len(self.nodes))]
+        df_vals = self.first_derivs_h4(self.step, self.f_vals)
         plot.plot(self.nodes, df_vals, 'o-', linewidth=1.5, label=f"f'(x) = {self.f.df.f_str}")
 
-        d2f_vals = [self.second_deriv(i, self.step, self.nodes, self.f_vals)[0] for i in range(len(self.nodes))]
+        d2f_vals = self.second_derivs(self.step, self.f_vals)
         plot.plot(self.nodes, d2f_vals, 'o-', linewidth=1.5, label=f"f\"(x) = {self.f.d2f.f_str}")
 
         plot.axhline(0, color='gray', linewidth=1.5)
@@ -154,14 +330,34 @@ class diff:
         plt.show(block=False)
 
 
+def variant_functions():
+    f1 = function(lambda x: math.log1p(x), "ln(1 + x)", vf=np.log1p)
+    f1.df = function(lambda x: 1 / (x + 1), "1 / (x + 1)", vf=lambda x: 1 / (x + 1))
+    f1.d2f = function(lambda x: -1 / ((x + 1) ** 2), "-1 / (x + 1)^2", vf=lambda x: -1 / ((x + 1) ** 2))
+
+    f2 = function(lambda x: math.exp(4.5 * x), "e^4.5x", vf=lambda x: np.exp(4.5 * x))
+    f2.df = function(lambda x: 4.5 * math.exp(4.5 * x), "4.5 * e^4.5x", vf=lambda x: 4.5 * np.exp(4.5 * x))
+    f2.d2f = function(lambda x: 20.25 * math.exp(4.5 * x), "20.25 * e^4.5x", vf=lambda x: 20.25 * np.exp(4.5 * x))
+    return f1, f2
+
+
+# one job of the batch mode, e.g. {"func": 2, "start": 0, "step": 0.1, "m": 10, "richardson": 4}: a record per node
+# with the derivatives and their errors, with "richardson" also the derivatives refined on that many levels
+def batch_job(job: dict):
+    f = variant_functions()[job["func"] - 1]
+    prog = diff(f, job["start"], job["step"], job["m"])
+    columns = dict(zip(("df_h2", "df_h2_error", "df_h4", "df_h4_error", "d2f", "d2f_error"), prog.res_table()))
+    if job.get("richardson"):
+        columns["df_richardson"] = prog.richardson(1, max_levels=job["richardson"]).best
+        columns["d2f_richardson"] = prog.richardson(2, max_levels=job["richardson"]).best
+    for i, x in enumerate(prog.nodes.tolist()):
+        yield dict(x=x, f=float(prog.f_vals[i]), **{name: float(col[i]) for name, col in columns.items()})
+
+
 def main():
-    f1 = function(lambda x: math.log1p(x), "ln(1 + x)")
-    f1.df = function(lambda x: 1 / (x + 1), "1 / (x + 1)")
-    f1.d2f = function(lambda x: -1 / ((x + 1) ** 2), "-1 / (x + 1)^2", )
+    import matplotlib.pyplot as plt
 
-    f2 = function(lambda x: math.exp(4.5 * x), "e^4.5x")
-    f2.df = function(lambda x: 4.5 * math.exp(4.5 * x), "4.5 * e^4.5x")
-    f2.d2f = function(lambda x: 20.25 * math.exp(4.5 * x), "20.25 * e^4.5x")
+    f1, f2 = variant_functions()
 
     print("Программа для нахождения производных таблично-заданной функции по формулам численного дифференцирования. Вариант №2")
 
@@ -202,5 +398,9 @@ def main():
             break
 
 # params usage: cat params | python3 main.py
+# batch usage: python3 main.py --batch jobs.json [--format csv] [--out results.csv]
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1:
+        run_batch(batch_job)
+    else:
+        main()
@@ -1,54 +1,484 @@
 from enum import unique
-import tabulate as tb
+import numpy as np
 import math
-import scipy
+import threading
+import hashlib
+import heapq
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import function, evaluate, instrument, profiling, run_batch
+
+
+# weight c * x^alpha, its moments are known in closed form
+class power_weight(function):
+    def __init__(self, alpha: float, c: float = 1, f_str: str = None):
+        super().__init__(lambda x: c * x ** alpha, f_str or f"{c} * x ^ {alpha}", vf=lambda x: c * x ** alpha)
+        self.alpha = alpha
+        self.c = c
+
+    # ∫ c * x^(alpha + k) dx over [left, right], None if x^alpha is not real on the segment
+    def moment(self, k: int, left: float, right: float):
+        if left < 0 and not float(self.alpha).is_integer():
+            return None
+        power = self.alpha + k + 1
+        if power == 0:
+            return self.c * math.log(right / left)
+        return self.c * (right ** power - left ** power) / power
+
+    def key(self) -> str:
+        return f"power({self.alpha!r}, {self.c!r})"
+
+    # ∫ c * x^alpha * g(x) dx over [left, right]; from 0 the singularity of x^alpha is left to
+    # the algebraic weight of quad
+    def integrate(self, g, left: float, right: float) -> float:
+        import scipy.integrate
+
+        if left == 0 and right > 0:
+            res, _ = scipy.integrate.quad(g, left, right, weight="alg", wvar=(self.alpha, 0), limit=200)
+            return self.c * res
+        res, _ = scipy.integrate.quad(lambda x: self(x) * g(x), left, right, limit=200)
+        return res
+
+
+# ∫ weight(x) * g(x) dx over [left, right], weights may provide their own integrate()
+def weighted_integral(weight, g, left: float, right: float) -> float:
+    import scipy.integrate
+
+    integrate = getattr(weight, "integrate", None)
+    if integrate is not None:
+        return integrate(g, left, right)
+    res, _ = scipy.integrate.quad(lambda x: weight(x) * g(x), left, right, limit=200)
+    return res
+
+
+# recurrence of the monic Legendre polynomials moved to [left, right]:
+# π_{k+1}(x) = (x - a_k) π_k(x) - b_k π_{k-1}(x)
+def legendre_recurrence(num: int, left: float, right: float):
+    k = np.arange(num)
+    a = np.full(num, (left + right) / 2)
+    b = ((right - left) / 2) ** 2 * k ** 2 / (4 * k ** 2 - 1)
+    return a, b
+
+
+def recurrence_poly(x, k: int, a, b):
+    prev, cur = 0, 1
+    for j in range(k):
+        prev, cur = cur, (x - a[j]) * cur - b[j] * prev
+    return cur
+
+
+# modified Chebyshev algorithm (Gautschi): recurrence coefficients alpha_k, beta_k (k < n) of the
+# polynomials orthogonal with the weight from its 2n modified moments ∫ p(x) π_k(x) dx, where π_k
+# are the polynomials of the recurrence (a, b); with the Legendre polynomials this is stable,
+# unlike the same computation from the ordinary moments ∫ p(x) x^k dx
+def modified_chebyshev(mom, a, b, n: int):
+    mom = np.asarray(mom, dtype=float)
+    alpha = np.zeros(n)
+    beta = np.zeros(n)
+    alpha[0] = a[0] + mom[1] / mom[0]
+    beta[0] = mom[0]
+
+    sig_prev = np.zeros(2 * n)
+    sig = mom.copy()
+    for k in range(1, n):
+        l = slice(k, 2 * n - k)
+        sig_new = np.zeros(2 * n)
+        sig_new[l] = (sig[k + 1:2 * n - k + 1] - (alpha[k - 1] - a[l]) * sig[l]
+                      - beta[k - 1] * sig_prev[l] + b[l] * sig[k - 1:2 * n - k - 1])
+        alpha[k] = a[k] + sig_new[k + 1] / sig_new[k] - sig[k] / sig[k - 1]
+        beta[k] = sig_new[k] / sig[k - 1]
+        sig_prev, sig = sig, sig_new
+    return alpha, beta
+
+
+# Gauss rule with n nodes for the weight on [left, right], exact for polynomials of degree 2n - 1:
+# the nodes are the eigenvalues of the symmetric tridiagonal Jacobi matrix of the recurrence and
+# the coefficients come from the first components of its eigenvectors (Golub-Welsch)
+def gauss_rule(weight, left: float, right: float, n: int):
+    import scipy.linalg
+
+    a, b = legendre_recurrence(2 * n, left, right)
+    mom = [weighted_integral(weight, lambda x, k=k: recurrence_poly(x, k, a, b), left, right) for k in range(2 * n)]
+    alpha, beta = modified_chebyshev(mom, a, b, n)
+    nodes, vecs = scipy.linalg.eigh_tridiagonal(alpha, np.sqrt(beta[1:]))
+    return list(nodes), list(beta[0] * vecs[0] ** 2)
+
+
+# compensated (Neumaier) sum, element-wise for arrays of equal shape
+def neumaier_sum(values):
+    total, comp = 0.0, 0.0
+    for val in values:
+        val = np.asarray(val, dtype=float)
+        res = total + val
+        comp = comp + np.where(np.abs(total) >= np.abs(val), (total - res) + val, (val - res) + total)
+        total = res
+    return total + comp
+
+
+# the integrals are split into chunks fixed by their number, not by the number of workers, and the
+# partial results are summed in the order of the chunks, so any number of workers gives the same value;
+# with m the chunks are made of whole sub-intervals of the grid of m equal ones (at most m chunks)
+def map_chunks(job: str, state, left: float, right: float, chunks: int, workers: int = None, m: int = None):
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing as mp
+
+    if m is None:
+        bounds, sizes = np.linspace(left, right, chunks + 1), [0] * chunks
+    else:
+        chunks = min(chunks, m)
+        cuts = np.arange(chunks + 1) * m // chunks
+        bounds, sizes = np.linspace(left, right, m + 1)[cuts], np.diff(cuts).tolist()
+    jobs = [(job, a, b, size) for a, b, size in zip(bounds[:-1].tolist(), bounds[1:].tolist(), sizes)]
+    if workers == 1:
+        _init_chunk_worker(state)
+        return neumaier_sum(map(_chunk_job, jobs))
+
+    # fork lets workers inherit f and the weight, so lambdas do not have to be picklable
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_chunk_worker, initargs=(state,)) as executor:
+        return neumaier_sum(executor.map(_chunk_job, jobs))
+
+
+# rule with the relative positions of the nodes in pattern applied on m equal sub-intervals
+def composite_rule(f, weight, left: float, right: float, pattern, m: int) -> float:
+    bounds = np.linspace(left, right, m + 1)
+    rules = [quad_rule.scaled(weight, a, b, pattern) for a, b in zip(bounds[:-1], bounds[1:])]
+    vals = evaluate(f, np.concatenate([rule.nodes for rule in rules]))
+    coeffs = np.concatenate([rule.coeffs for rule in rules])
+    return float(coeffs @ vals)
+
+
+# ∫ weight(x) * g(x) dx over [left, right] by chunks in worker processes
+def parallel_integral(weight, g, left: float, right: float, chunks: int, workers: int = None) -> float:
+    return float(map_chunks("quad", (g, weight, None, 0), left, right, chunks, workers))
 
 
 class integral:
     def __init__(self, f, weight, left, right, nodes):
         self.f = f
+        self.moments = None
+        self.coeffs = None
         self.weight = weight
         self.left = left
         self.right = right
         self.nodes = nodes
 
+    # the moments and the coefficients depend on the weight, the bounds and the nodes,
+    # so changing any of them drops the cached values
+    def __setattr__(self, name, value):
+        if name in ("weight", "left", "right", "nodes"):
+            super().__setattr__("moments", None)
+            super().__setattr__("coeffs", None)
+            if name == "nodes":
+                value = tuple(value)
+        super().__setattr__(name, value)
+
+    @instrument(functions=())
     def calc_moments(self):
-        res = []
-        
-        for k in range(len(self.nodes)):
+        if self.moments is None:
+            self.moments = [self.calc_moment(k) for k in range(len(self.nodes))]
+        return list(self.moments)
+
+    # moments as sums over chunks of [left, right] computed in worker processes
+    @instrument(functions=())
+    def calc_moments_parallel(self, chunks: int, workers: int = None):
+        if self.moments is None:
+            state = (None, self.weight, None, len(self.nodes))
+            self.moments = list(map_chunks("moments", state, self.left, self.right, chunks, workers).tolist())
+        return list(self.moments)
+
+    def calc_moment(self, k: int) -> float:
+        moment = getattr(self.weight, "moment", None)
+        res = moment(k, self.left, self.right) if moment is not None else None
+        if res is None:
+            import scipy.integrate
+
             f = lambda x: self.weight(x) * x ** k
-            moment, _ = scipy.integrate.quad(f, self.left, self.right)
-            res.append(moment)
+            res, _ = scipy.integrate.quad(f, self.left, self.right)
         return res
 
+    # integral on the n-point Gauss rule of the weight instead of user-chosen nodes
+    @classmethod
+    def gauss(cls, f, weight, left, right, n: int):
+        nodes, coeffs = gauss_rule(weight, left, right, n)
+        kf = cls(f, weight, left, right, nodes)
+        kf.coeffs = coeffs
+        return kf
+
+    @instrument(functions=())
     def calc_coeffs(self):
-        matrix = []
-        for k in range(len(self.nodes)):
-            f = lambda x: x ** k
-            line = [f(node) for node in self.nodes]
-            matrix.append(line)
+        if self.coeffs is None:
+            import scipy.linalg
 
-        moments = self.calc_moments()
-        res = list(scipy.linalg.solve(matrix, moments))
-        return res
+            matrix = []
+            for k in range(len(self.nodes)):
+                f = lambda x: x ** k
+                line = [f(node) for node in self.nodes]
+                matrix.append(line)
+
+            moments = self.calc_moments()
+            self.coeffs = list(scipy.linalg.solve(matrix, moments))
+        return list(self.coeffs)
 
+    @instrument()
     def integrate(self):
         res = 0
         coeffs = self.calc_coeffs()
+        vals = evaluate(self.f, self.nodes)
         
         for k in range(len(self.nodes)):
-            res += coeffs[k] * self.f(self.nodes[k])
+            res += coeffs[k] * vals[k]
         
         return res
 
+    # positions of the nodes relative to [left, right], the same pattern is used on sub-intervals
+    def pattern(self) -> np.ndarray:
+        return (np.asarray(self.nodes, dtype=float) - self.left) / (self.right - self.left)
+
+    # the rule applied on m equal sub-intervals, f is evaluated at all their nodes at once; with
+    # chunks the sub-intervals are split between worker processes, about m / chunks in each
+    @instrument()
+    def composite(self, m: int, chunks: int = None, workers: int = None) -> float:
+        if chunks is not None:
+            state = (self.f, self.weight, self.pattern(), 0)
+            return float(map_chunks("composite", state, self.left, self.right, chunks, workers, m))
+
+        return composite_rule(self.f, self.weight, self.left, self.right, self.pattern(), m)
+
+    # adaptive composite rule: the estimate on a sub-interval is compared with the sum over its
+    # halves and the sub-interval with the largest disagreement is bisected until the sum of the
+    # errors drops below tol; values of f at coinciding nodes and the estimates on the halves are
+    # reused on the next level. A rule with n nodes is exact at least for degree n - 1, so halving
+    # reduces its error about 2^n times and the error of the halves is |halves - whole| / (2^n - 1)
+    @instrument(result=lambda res: dict(evals=res.evals, intervals=res.intervals, err=res.err,
+                                        stop_reason=res.stop_reason))
+    def adaptive(self, tol: float = 1e-10, max_evals: int = 10_000) -> "quad_result":
+        pattern = self.pattern()
+        factor = 2 ** len(pattern) - 1
+        values = {}
+
+        def estimate(a, b):
+            rule = quad_rule.scaled(self.weight, a, b, pattern)
+            new = list(dict.fromkeys(x for x in rule.nodes.tolist() if x not in values))
+            if new:
+                values.update(zip(new, evaluate(self.f, new)))
+            return float(rule.coeffs @ np.array([values[x] for x in rule.nodes.tolist()]))
+
+        def split(a, b, whole):
+            mid = (a + b) / 2
+            l, r = estimate(a, mid), estimate(mid, b)
+            return -abs(l + r - whole) / factor, a, b, l, r
+
+        heap = [split(self.left, self.right, estimate(self.left, self.right))]
+        # running sum of the errors in the heap, it is recomputed exactly at the end
+        total = -heap[0][0]
+        stop_reason = "converged"
+        while total > tol:
+            if len(values) >= max_evals:
+                stop_reason = "max_evals"
+                break
+            _, a, b, l, r = heap[0]
+            mid = (a + b) / 2
+            if mid in (a, b) or (a + mid) / 2 in (a, mid) or (mid + b) / 2 in (mid, b):
+                stop_reason = "min_len"
+                break
+            first, second = split(a, mid, l), split(mid, b, r)
+            total += heapq.heapreplace(heap, first)[0] - first[0] - second[0]
+            heapq.heappush(heap, second)
+            if profiling.tracing:
+                profiling.trace(intervals=len(heap), evals=len(values), err=total)
+
+        val = math.fsum(item[3] + item[4] for item in heap)
+        err = -math.fsum(item[0] for item in heap)
+        return quad_result(val, err, len(values), len(heap), stop_reason)
+
+
+
+# moments ∫ p(x) t^k dx, t = (x - a) / (b - a), k < num. The binomial expansion of ((x - a) / h)^k
+# over the closed-form moments of the weight has terms of the order (|a| / h)^k that cancel, so it
+# is used only on sub-intervals not far from 0 compared to their length, otherwise quad is used
+def scaled_moments(weight, a: float, b: float, num: int):
+    moment = getattr(weight, "moment", None)
+    raw = [moment(j, a, b) for j in range(num)] if moment is not None and abs(a) <= b - a else [None]
+    if None in raw:
+        return [weighted_integral(weight, lambda x, k=k: ((x - a) / (b - a)) ** k, a, b) for k in range(num)]
+
+    h = b - a
+    return [math.fsum(math.comb(k, j) * (-a) ** (k - j) * raw[j] for j in range(k + 1)) / h ** k for k in range(num)]
+
+
+# quadrature rule ∫ p(x) f(x) dx ≈ Σ A_k f(x_k) detached from the integrand: the nodes and the
+# coefficients are read-only arrays, so one rule can be applied to any number of functions
+class quad_rule:
+    def __init__(self, nodes, coeffs, left: float, right: float):
+        self._nodes = np.array(nodes, dtype=float)
+        self._coeffs = np.array(coeffs, dtype=float)
+        self._nodes.flags.writeable = False
+        self._coeffs.flags.writeable = False
+        self._left = left
+        self._right = right
+
+    @property
+    def nodes(self) -> np.ndarray:
+        return self._nodes
+
+    @property
+    def coeffs(self) -> np.ndarray:
+        return self._coeffs
+
+    @property
+    def left(self) -> float:
+        return self._left
+
+    @property
+    def right(self) -> float:
+        return self._right
+
+    def apply(self, f) -> float:
+        return float(self.coeffs @ evaluate(f, self.nodes))
+
+    # integrals of many functions: fs is a list of functions, or one function that maps the array of
+    # nodes to an (m, n) array of the values of m integrands
+    def apply_many(self, fs) -> np.ndarray:
+        if callable(fs):
+            vals = np.asarray(fs(self.nodes), dtype=float)
+        else:
+            vals = np.stack([evaluate(f, self.nodes) for f in fs])
+        return vals @ self.coeffs
+
+    # rule with the nodes a + t (b - a) for the relative positions t in pattern; the coefficients are
+    # found for the powers of t, which keeps the system well conditioned on short sub-intervals
+    @classmethod
+    def scaled(cls, weight, a: float, b: float, pattern):
+        import scipy.linalg
+
+        t = np.asarray(pattern, dtype=float)
+        mom = scaled_moments(weight, a, b, len(t))
+        coeffs = scipy.linalg.solve(np.vander(t, increasing=True).T, mom)
+        return cls(a * (1 - t) + b * t, coeffs, a, b)
+
+    # rule with the given nodes, coefficients from the moments of the weight
+    @classmethod
+    def interpolatory(cls, weight, left: float, right: float, nodes, cache_dir: str = None):
+        build = lambda: cls(nodes, integral(None, weight, left, right, nodes).calc_coeffs(), left, right)
+        return cls.cached(build, cache_dir, "interpolatory", weight, left, right, tuple(map(float, nodes)))
+
+    @classmethod
+    def gauss(cls, weight, left: float, right: float, n: int, cache_dir: str = None):
+        build = lambda: cls(*gauss_rule(weight, left, right, n), left, right)
+        return cls.cached(build, cache_dir, "gauss", weight, left, right, n)
+
+    # with cache_dir the rule is stored in a file named by the hash of its parameters and read from
+    # there next time; weights are identified by their key(), rules of weights without one are not
+    # stored (f_str is only a label and may be shared by different weights)
+    @classmethod
+    def cached(cls, build, cache_dir, *params):
+        key = getattr(params[1], "key", None)
+        weight_key = key() if key is not None else None
+        if cache_dir is None or not weight_key:
+            return build()
+
+        digest = hashlib.sha256(repr((*params[:1], weight_key, *params[2:])).encode()).hexdigest()
+        path = os.path.join(cache_dir, f"{digest}.npz")
+        if os.path.exists(path):
+            return cls.load(path)
+        rule = build()
+        os.makedirs(cache_dir, exist_ok=True)
+        rule.save(path)
+        return rule
+
+    def save(self, path: str):
+        np.savez(path, nodes=self.nodes, coeffs=self.coeffs, bounds=[self.left, self.right])
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            left, right = data["bounds"]
+            return cls(data["nodes"], data["coeffs"], float(left), float(right))
+
+
+class quad_result:
+    stop_reasons = {
+        "converged": "достигнута заданная точность",
+        "max_evals": "превышено максимальное число вычислений функции",
+        "min_len": "отрезки разбиения достигли машинной точности",
+    }
+
+    def __init__(self, val: float, err: float, evals: int, intervals: int, stop_reason: str = "converged"):
+        self.val = val
+        self.err = err
+        self.evals = evals
+        self.intervals = intervals
+        self.stop_reason = stop_reason
+
+    def converged(self) -> bool:
+        return self.stop_reason == "converged"
+
+    def __str__(self):
+        res = f"Значение интеграла: {self.val}\n" \
+              f"Оценка погрешности: {self.err}\n" \
+              f"Число отрезков разбиения: {self.intervals}, вычислений f(x): {self.evals}\n"
+        res += f"Причина остановки: {self.stop_reasons[self.stop_reason]}\n" if not self.converged() else ""
+        return res
+
+
+_worker = threading.local()
+
+
+def _init_chunk_worker(state) -> None:
+    _worker.state = state
+
+
+def _chunk_job(job):
+    kind, a, b, size = job
+    f, weight, pattern, num = _worker.state
+    if kind == "quad":
+        return weighted_integral(weight, f, a, b)
+    if kind == "moments":
+        return integral(None, weight, a, b, range(num)).calc_moments()
+    return composite_rule(f, weight, a, b, pattern, size)
+
+
+def variant():
+    f = function(lambda x: math.sin(x), "sin(x)", vf=np.sin)
+    p = power_weight(1 / 4, f_str="x ^ (1 / 4)")
+    return f, p
+
+
+# one job of the batch mode, e.g. {"left": 0, "right": 10, "nodes": [1, 2, 3, 4], "gauss": 5, "tol": 1e-10,
+# "reference": true}: a record for the rule on the nodes, the Gauss rule with the given number of nodes,
+# the adaptive rule with the given tolerance and the reference value of quad, the errors are taken
+# against the reference value
+def batch_job(job: dict):
+    f, p = variant()
+    left, right = job["left"], job["right"]
+    precise = weighted_integral(p, f, left, right) if job.get("reference") else None
+
+    def record(method, val, evals, err=None):
+        abs_error = abs(val - precise) if precise is not None else None
+        return dict(method=method, value=val, abs_error=abs_error, err_estimate=err, evals=evals)
+
+    if precise is not None:
+        yield record("reference", precise, None)
+    if job.get("nodes"):
+        yield record("interpolatory", float(integral(f, p, left, right, job["nodes"]).integrate()), len(job["nodes"]))
+    if job.get("gauss"):
+        yield record("gauss", float(integral.gauss(f, p, left, right, job["gauss"]).integrate()), job["gauss"])
+    if job.get("tol") and job.get("nodes"):
+        res = integral(f, p, left, right, job["nodes"]).adaptive(job["tol"])
+        yield record("adaptive", res.val, res.evals, res.err)
 
 
 def main():
+    import scipy.integrate
+    import tabulate as tb
+
     print("Приближенное вычисление интегралов при помощи ИКФ. Вариант 2\n")
     print("Вычисление интеграла от функции p(x) * f(x), где p(x) = x ^ (1 / 4), f(x) = sin(x)\n")
 
-    f = lambda x: math.sin(x)
-    p = lambda x: x ** (1 / 4)
+    f, p = variant()
     phi = lambda x: f(x) * p(x)
     
     left = float(input("Введите левый конец отрезка: ") or 0)
@@ -87,9 +517,20 @@ def main():
     print(f"Абсолютная погрешность: {abs_error}")
     print(f"Относительная погрешность: {rel_error}")
     print()
+
+    gauss_val = integral.gauss(f, p, left, right, num_nodes).integrate()
+    print(f"Значение по КФ Гаусса с {num_nodes} узлами: {gauss_val}")
+    print(f"Абсолютная погрешность: {abs(gauss_val - precise_val)}")
+    print()
+
+    print("Адаптивная составная ИКФ:")
+    adaptive = kf.adaptive(tol=1e-12)
+    print(adaptive, end="")
+    print(f"Абсолютная погрешность: {abs(adaptive.val - precise_val)}")
+    print()
     
     poly = lambda x: 5 * x ** (num_nodes - 1) + 3
-    weight = lambda _: 1
+    weight = power_weight(0, f_str="1")
     kf = integral(poly, weight, left, right, nodes)
     poly_calc_val = kf.integrate()
     poly_precise_val, _ = scipy.integrate.quad(poly, left, right)
@@ -103,5 +544,9 @@ def main():
     print(f"Относительная погрешность: {poly_rel_error}")
 
 # params usage: cat params | python3 main.py
+# batch usage: python3 main.py --batch jobs.json [--format csv] [--out results.csv]
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        run_batch(batch_job)
+    else:
+        main()
\ No newline at end of file
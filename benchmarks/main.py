@@ -0,0 +1,267 @@
+import importlib.util
+import subprocess
+import tracemalloc
+import argparse
+import platform
+import json
+import math
+import time
+import sys
+import os
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(ROOT)
+from common import function
+
+
+# the modules live in directories that are not valid package names, so they are loaded by path
+def load(name: str, dir_name: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, dir_name, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+roots = load("roots", "1. roots")
+interpolation = load("interpolation", "2. interpolation")
+derivative = load("derivative", "3. derivative")
+integration = load("integration", "4. integration")
+
+
+# function that counts the points it was evaluated at
+class counted(function):
+    def __init__(self, f: function):
+        super().__init__(f.f, f.f_str, vf=f.vf, df=f.df, d2f=f.d2f)
+        self.evals = 0
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            return self.many(x)
+        self.evals += 1
+        return self.f(x)
+
+    def many(self, xs) -> np.ndarray:
+        res = super().many(xs)
+        self.evals += res.size
+        return res
+
+
+# Every case is a function of its parameters that does the preparation which is not measured and
+# returns run(); run() does the measured work and returns the number of evaluations of f and the
+# error of the result.
+
+def roots_f():
+    f = function(lambda x: pow(2, -x) - math.sin(x), "2^(-x) - sin(x)",
+                 vf=lambda x: np.power(2.0, -x) - np.sin(x))
+    f.df = function(lambda x: -pow(2, -x) * math.log(2) - math.cos(x), "-2^(-x) * ln(2) - cos(x)",
+                    vf=lambda x: -np.power(2.0, -x) * math.log(2) - np.cos(x))
+    return f
+
+
+def root_sections_case(steps: int):
+    f = roots_f()
+
+    def run():
+        finder = roots.root_finder(f, None, roots.interval(-5, 10), steps, 1e-12)
+        sections = finder.get_root_sections()
+        return dict(evals=finder.counters()[0], error=max(section.len() for section in sections))
+    return run
+
+
+def root_solver_case(method: str, steps: int):
+    f = roots_f()
+    sections = roots.root_finder(f, None, roots.interval(-5, 10), steps, 1e-12).get_root_sections()
+
+    def run():
+        finder = roots.root_finder(f, None, roots.interval(-5, 10), steps, 1e-12)
+        res = [getattr(finder, method)(section) for section in sections]
+        return dict(evals=sum(r.f_evals + r.df_evals for r in res), error=max(r.abs_dif for r in res))
+    return run
+
+
+def interpolate_case(num_nodes: int, degree: int, points: int = 200):
+    xs = np.random.default_rng(0).uniform(0, 1, points)
+    exact = np.log1p(xs)
+
+    def run():
+        f = counted(function(math.log1p, vf=np.log1p))
+        inter = interpolation.interpol(f, 0, 1, num_nodes)
+        inter.degree = degree
+        vals = np.array([inter.interpolate(x) for x in xs])
+        return dict(evals=f.evals, error=float(np.abs(vals - exact).max()))
+    return run
+
+
+def interpolate_many_case(num_nodes: int, degree: int, points: int = 100_000):
+    xs = np.random.default_rng(0).uniform(0, 1, points)
+    exact = np.log1p(xs)
+
+    def run():
+        f = counted(function(math.log1p, vf=np.log1p))
+        inter = interpolation.interpol(f, 0, 1, num_nodes)
+        inter.degree = degree
+        return dict(evals=f.evals, error=float(np.abs(inter.interpolate_many(xs) - exact).max()))
+    return run
+
+
+def derivative_f():
+    f = function(lambda x: math.exp(4.5 * x), "e^4.5x", vf=lambda x: np.exp(4.5 * x))
+    f.df = function(lambda x: 4.5 * math.exp(4.5 * x), vf=lambda x: 4.5 * np.exp(4.5 * x))
+    f.d2f = function(lambda x: 20.25 * math.exp(4.5 * x), vf=lambda x: 20.25 * np.exp(4.5 * x))
+    return f
+
+
+def res_table_case(m: int):
+    def run():
+        f = counted(derivative_f())
+        columns = derivative.diff(f, 0, 1 / m, m).res_table()
+        return dict(evals=f.evals, error=float(columns[3].max()))
+    return run
+
+
+def runge_case(m: int):
+    def run():
+        f = counted(derivative_f())
+        prog = derivative.diff(f, 0, 1 / m, m)
+        df = prog.richardson(1, max_levels=2).tableau[1, 1]
+        d2f = prog.richardson(2, max_levels=2).tableau[1, 1]
+        error = max(np.abs(df - f.df(prog.nodes)).max(), np.abs(d2f - f.d2f(prog.nodes)).max())
+        return dict(evals=f.evals, error=float(error))
+    return run
+
+
+def integration_setup():
+    p = integration.power_weight(1 / 4, f_str="x ^ (1 / 4)")
+    precise = integration.parallel_integral(p, math.sin, 0, 10, 16, workers=1)
+    return p, precise
+
+
+def integrate_case(num_nodes: int):
+    p, precise = integration_setup()
+    nodes = np.linspace(0, 10, num_nodes).tolist()
+
+    def run():
+        f = counted(function(math.sin, vf=np.sin))
+        val = integration.integral(f, p, 0, 10, nodes).integrate()
+        return dict(evals=f.evals, error=abs(val - precise))
+    return run
+
+
+def gauss_case(num_nodes: int):
+    p, precise = integration_setup()
+
+    def run():
+        f = counted(function(math.sin, vf=np.sin))
+        val = integration.integral.gauss(f, p, 0, 10, num_nodes).integrate()
+        return dict(evals=f.evals, error=abs(val - precise))
+    return run
+
+
+def adaptive_case(tol: float):
+    p, precise = integration_setup()
+
+    def run():
+        f = counted(function(math.sin, vf=np.sin))
+        res = integration.integral(f, p, 0, 10, [0, 10 / 3, 20 / 3, 10]).adaptive(tol)
+        return dict(evals=f.evals, error=abs(res.val - precise))
+    return run
+
+
+# (module, case, build, parameter sets); with --quick only the first two sets of every case are run
+CASES = [
+    ("roots", "get_root_sections", root_sections_case, [dict(steps=10 ** k) for k in range(3, 7)]),
+    *[("roots", method, lambda steps, method=method: root_solver_case(method, steps),
+       [dict(steps=10 ** k) for k in range(2, 6)]) for method in roots.root_finder.methods],
+    ("interpolation", "interpolate", interpolate_case,
+     [dict(num_nodes=n, degree=d) for d in (3, 7, 15) for n in (10 ** 3, 10 ** 4, 10 ** 5)]),
+    ("interpolation", "interpolate_many", interpolate_many_case,
+     [dict(num_nodes=n, degree=d) for d in (3, 7, 15) for n in (10 ** 3, 10 ** 4, 10 ** 5)]),
+    ("derivative", "res_table", res_table_case, [dict(m=10 ** k) for k in range(2, 7)]),
+    ("derivative", "runge", runge_case, [dict(m=10 ** k) for k in range(2, 7)]),
+    ("integration", "integrate", integrate_case, [dict(num_nodes=n) for n in (2, 4, 8, 16, 32)]),
+    ("integration", "gauss", gauss_case, [dict(num_nodes=n) for n in (2, 4, 8, 16, 32)]),
+    ("integration", "adaptive", adaptive_case, [dict(tol=10.0 ** -k) for k in (4, 6, 8, 10, 12)]),
+]
+
+
+# the first run is traced for the peak memory, the evaluation count and the error, the wall time
+# is the best of `repeat` untraced runs
+def measure(build, params: dict, repeat: int) -> dict:
+    run = build(**params)
+    tracemalloc.start()
+    res = run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return dict(wall_time=min(times), evals=int(res["evals"]), peak_memory=peak, error=float(res["error"]))
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return dict(commit=commit or None, time=time.strftime("%Y-%m-%dT%H:%M:%S"), python=platform.python_version(),
+                numpy=np.__version__, platform=platform.platform())
+
+
+def key(record: dict) -> str:
+    return json.dumps([record["module"], record["case"], record["params"]], sort_keys=True)
+
+
+# wall times of the records against the same cases of an earlier run
+def compare(results, path: str, threshold: float):
+    with open(path) as file:
+        old = {key(record): record for record in json.load(file)["results"]}
+
+    print(f"\nСравнение с {path}:")
+    for record in results:
+        prev = old.get(key(record))
+        if prev is None:
+            continue
+        ratio = record["wall_time"] / prev["wall_time"] if prev["wall_time"] > 0 else math.inf
+        mark = "  <- замедление" if ratio > threshold else ""
+        print(f"{record['module']:<14}{record['case']:<20}{json.dumps(record['params']):<36}{ratio:8.2f}x{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки модулей численных методов")
+    parser.add_argument("--quick", action="store_true", help="только два первых набора параметров каждого случая")
+    parser.add_argument("--repeat", type=int, default=3, help="число замеров времени")
+    parser.add_argument("--module", action="append", help="запустить только случаи этого модуля")
+    parser.add_argument("--out", help="файл для результатов в формате JSON")
+    parser.add_argument("--compare", help="файл с результатами прошлого запуска")
+    parser.add_argument("--threshold", type=float, default=1.2, help="отношение времён, считающееся замедлением")
+    args = parser.parse_args()
+
+    results = []
+    for module, case, build, param_sets in CASES:
+        if args.module and module not in args.module:
+            continue
+        for params in param_sets[:2] if args.quick else param_sets:
+            record = dict(module=module, case=case, params=params, **measure(build, params, args.repeat))
+            results.append(record)
+            print(f"{module:<14}{case:<20}{json.dumps(params):<36}{record['wall_time']:12.6f} s"
+                  f"{record['evals']:10d}{record['peak_memory'] / 2 ** 20:10.2f} MiB{record['error']:12.3e}",
+                  flush=True)
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(dict(meta=metadata(), results=results), file, indent=1)
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+
+
+# usage: python3 benchmarks/main.py [--quick] [--out results.json] [--compare old.json]
+if __name__ == "__main__":
+    main()
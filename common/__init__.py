@@ -0,0 +1,4 @@
+from .function import function, evaluate
+from .profiling import instrument, instrumented, enable, disable, memory_sink, jsonl_sink
+from . import profiling
+from .batch import run_batch
@@ -0,0 +1,60 @@
+from typing import Callable, Iterable
+import argparse
+import json
+import csv
+import sys
+
+
+# Batch mode of the programs: jobs are read as JSON (one object, an array of objects or one object per
+# line), every job yields result records that are written as soon as they are computed, as JSON lines
+# or as CSV. CSV columns are the keys of the first record, missing values are left empty.
+
+def read_jobs(file) -> list:
+    text = file.read()
+    try:
+        jobs = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return jobs if isinstance(jobs, list) else [jobs]
+
+
+class result_writer:
+    def __init__(self, file, fmt: str = "jsonl"):
+        self.file = file
+        self.fmt = fmt
+        self.writer = None
+
+    def write(self, record: dict):
+        if self.fmt == "csv":
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.file, fieldnames=list(record), extrasaction="ignore")
+                self.writer.writeheader()
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+
+# run_job(job) -> records; every record gets the number of its job
+def run_batch(run_job: Callable[[dict], Iterable[dict]], argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный режим: задания в формате JSON, результаты в JSON lines или CSV")
+    parser.add_argument("--batch", metavar="JOBS", required=True, help="файл с заданиями, - для стандартного ввода")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl", help="формат результатов")
+    parser.add_argument("--out", default="-", help="файл для результатов, - для стандартного вывода")
+    args = parser.parse_args(argv)
+
+    if args.batch == "-":
+        jobs = read_jobs(sys.stdin)
+    else:
+        with open(args.batch) as file:
+            jobs = read_jobs(file)
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        writer = result_writer(out, args.format)
+        for num, job in enumerate(jobs):
+            for record in run_job(job):
+                writer.write(dict(job=num, **record))
+    finally:
+        if out is not sys.stdout:
+            out.close()
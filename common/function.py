@@ -0,0 +1,41 @@
+from typing import Callable
+import numpy as np
+
+
+# function of one variable with an optional array implementation and attached derivatives:
+# f is called for numbers, vf (e.g. an expression of NumPy ufuncs) for arrays; without vf
+# arrays are evaluated point by point with f
+class function:
+    def __init__(self, f: Callable[[float], float], f_str: str = "", vf: Callable = None,
+                 df: "function" = None, d2f: "function" = None):
+        self.f_str = f_str
+        self.f: Callable[[float], float] = f
+        self.vf: Callable = vf
+        self.df: function = df
+        self.d2f: function = d2f
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            return self.many(x)
+        return self.f(x)
+
+    def many(self, xs) -> np.ndarray:
+        xs = np.asarray(xs, dtype=float)
+        if self.vf is not None:
+            ys = np.asarray(self.vf(xs), dtype=float)
+            # a constant vf gives a scalar, it is spread over a new (writable) array of the shape of xs
+            return ys if ys.shape == xs.shape else np.array(np.broadcast_to(ys, xs.shape))
+        return np.fromiter(map(self.f, xs.ravel()), dtype=float, count=xs.size).reshape(xs.shape)
+
+    def __str__(self) -> str:
+        return self.f_str
+
+
+# values of f at every point of xs: a single call for objects with an array path (many),
+# a loop over the points for plain callables
+def evaluate(f: Callable, xs) -> np.ndarray:
+    xs = np.asarray(xs, dtype=float)
+    many = getattr(f, "many", None)
+    if many is not None:
+        return many(xs)
+    return np.fromiter(map(f, xs.ravel()), dtype=float, count=xs.size).reshape(xs.shape)
@@ -0,0 +1,197 @@
+from contextlib import contextmanager
+from typing import Callable, Sequence
+import functools
+import threading
+import json
+import time
+import numpy as np
+
+from .function import evaluate
+
+
+# Opt-in instrumentation of the entry points of the solvers. Methods marked with @instrument write
+# one record per call to the active sink: the wall time, the calls, points and time spent in the
+# probed functions (f, df, ...), counters and results reported by the class, and, with traces on,
+# the values passed to trace() during the call. Nested instrumented calls give separate records,
+# depth tells how deep a record is within its thread. Without a sink a marked method costs one extra
+# attribute check; hot loops check the module flag tracing before calling trace().
+
+# records kept in a list
+class memory_sink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record: dict):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+# records written as JSON lines to a file or a path
+class jsonl_sink:
+    def __init__(self, file):
+        self.owned = isinstance(file, str)
+        self.file = open(file, "a") if self.owned else file
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, default=_jsonable) + "\n")
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class _state:
+    sink = None
+    traces = False
+
+
+# records of the calls in progress in every thread, innermost last; a record collects the trace
+# only if traces were on when its call started
+_local = threading.local()
+
+
+def _stack() -> list:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+tracing = False
+
+
+def enable(sink, traces: bool = False):
+    global tracing
+    _state.sink = sink
+    _state.traces = tracing = traces
+
+
+def disable():
+    enable(None)
+
+
+def enabled() -> bool:
+    return _state.sink is not None
+
+
+# with instrumented() as sink: ... - records of the calls inside the block go to sink
+# (a new memory_sink by default), the previous sink is restored afterwards
+@contextmanager
+def instrumented(sink=None, traces: bool = False):
+    sink = memory_sink() if sink is None else sink
+    prev = _state.sink, _state.traces
+    enable(sink, traces)
+    try:
+        yield sink
+    finally:
+        enable(*prev)
+
+
+# adds the values to the trace of the innermost instrumented call of the thread when it is traced
+def trace(**values):
+    stack = getattr(_local, "stack", None)
+    if stack and "trace" in stack[-1]:
+        stack[-1]["trace"].append(values)
+
+
+# counts the calls and the points of f and the time spent in it, other attributes are taken from f
+class probe:
+    def __init__(self, f: Callable):
+        self.func = f
+        self.calls = 0
+        self.points = 0
+        self.time = 0.0
+
+    def __call__(self, x):
+        start = time.perf_counter()
+        try:
+            return self.func(x)
+        finally:
+            self.time += time.perf_counter() - start
+            self.calls += 1
+            self.points += np.size(x)
+
+    def many(self, xs) -> np.ndarray:
+        start = time.perf_counter()
+        try:
+            many = getattr(self.func, "many", None)
+            return many(xs) if many is not None else evaluate(self.func, xs)
+        finally:
+            self.time += time.perf_counter() - start
+            self.calls += 1
+            self.points += np.size(xs)
+
+    def __getattr__(self, name):
+        return getattr(self.func, name)
+
+
+# marks a method as an entry point: functions are the names of the attributes of the object that are
+# probed during the call, counters(obj) and result(res) return dicts of numbers added to the record
+# (the counters as the difference between the end and the start of the call)
+def instrument(name: str = None, functions: Sequence[str] = ("f",), counters: Callable = None,
+               result: Callable = None):
+    def decorator(method):
+        label = name or method.__qualname__
+
+        @functools.wraps(method)
+        def wrapper(obj, *args, **kwargs):
+            if _state.sink is None:
+                return method(obj, *args, **kwargs)
+            return _record(label, method, obj, args, kwargs, functions, counters, result)
+        return wrapper
+    return decorator
+
+
+def _record(label, method, obj, args, kwargs, functions, counters, result):
+    sink = _state.sink
+    probes, installed = {}, []
+    for attr in functions:
+        f = getattr(obj, attr, None)
+        if f is None:
+            continue
+        if not isinstance(f, probe):
+            f = probe(f)
+            setattr(obj, attr, f)
+            installed.append(attr)
+        probes[attr] = (f, f.calls, f.points, f.time)
+
+    stack = _stack()
+    record = dict(call=label, depth=len(stack))
+    if _state.traces:
+        record["trace"] = []
+    before = counters(obj) if counters is not None else None
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        res = method(obj, *args, **kwargs)
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["time"] = time.perf_counter() - start
+        stack.pop()
+        for attr in installed:
+            setattr(obj, attr, probes[attr][0].func)
+        for attr, (f, calls, points, spent) in probes.items():
+            record[attr] = dict(calls=f.calls - calls, points=f.points - points, time=f.time - spent)
+        if before is not None:
+            record.update({key: val - before[key] for key, val in counters(obj).items()})
+        if "error" in record:
+            sink.write(record)
+
+    if result is not None:
+        record.update(result(res))
+    sink.write(record)
+    return res